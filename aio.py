@@ -0,0 +1,126 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import traceback
+import columnar
+from generate import DataExtractor
+from load import ModManager, PropertyTree
+from prototype import IconLoader
+
+
+def _run_extraction(connection, game_dir, mods_dir, difficulty, settings, sections, extras, extractor_options):
+    # lua runs here, the parent only receives the sections and the icon keys of the requested sheets
+    try:
+        mod_settings = PropertyTree.load_mod_settings(settings) if settings is not None else None
+        data_extractor = DataExtractor(game_dir, mods_dir, difficulty, mod_settings=mod_settings, sections=sections,
+                                       progress=connection.send, **extractor_options)
+        result = data_extractor.generate(extras, render=False)[3]
+        icon_sheets = data_extractor.get_stage('icon_sheets')
+        sheets = {sheet: icon_sheets[sheet] for sheet in DataExtractor.icon_sheets if data_extractor.wants(sheet)}
+        connection.send({'event': 'result', 'result': result, 'sheets': sheets,
+                         'tiled': data_extractor.tiled_atlases})
+    except Exception:
+        connection.send({'event': 'error', 'error': traceback.format_exc()})
+    finally:
+        connection.close()
+
+
+class AsyncExtractor:
+    def __init__(self, game_dir, mods_dir, difficulty, settings=None, sections=None, extras=(),
+                 mp_context=None, executor=None, icon_loader=None, max_atlas_size=None, group_atlases=False,
+                 compact_limitations=False):
+        self.game_dir = game_dir
+        self.mods_dir = mods_dir
+        self.difficulty = difficulty
+        self.settings = settings
+        self.sections = sections
+        self.extras = tuple(extras)
+        self.mp_context = mp_context or multiprocessing.get_context()
+        self.executor = executor
+        self.icon_loader = icon_loader
+        self.extractor_options = {'max_atlas_size': max_atlas_size, 'group_atlases': group_atlases,
+                                  'compact_limitations': compact_limitations}
+        self.process = None
+        self.result = None
+        self.images = {}
+
+    def __aiter__(self):
+        return self.events()
+
+    async def events(self):
+        loop = asyncio.get_running_loop()
+        receiver, sender = self.mp_context.Pipe(duplex=False)
+        self.process = self.mp_context.Process(target=_run_extraction, daemon=True,
+                                               args=(sender, self.game_dir, self.mods_dir, self.difficulty,
+                                                     self.settings, self.sections, self.extras, self.extractor_options))
+        self.process.start()
+        sender.close()
+        receiving = False
+        try:
+            while True:
+                receiving = True
+                try:
+                    event = await loop.run_in_executor(self.executor, receiver.recv)
+                    receiving = False
+                except EOFError:
+                    raise RuntimeError('Extraction worker exited with code ' + str(self.process.exitcode))
+                if event['event'] == 'error':
+                    raise RuntimeError('Extraction failed\n' + event['error'])
+                if event['event'] == 'result':
+                    break
+                yield event
+            # a worker holding a large lua heap can take a while to exit
+            await loop.run_in_executor(self.executor, self.process.join)
+            self.result = event['result']
+            if event['sheets']:
+                if self.icon_loader is None:
+                    mod_manager = await loop.run_in_executor(self.executor, ModManager, self.game_dir, self.mods_dir)
+                    self.icon_loader = IconLoader(mod_manager)
+                for sheet, (keys, icon_size, tiles) in event['sheets'].items():
+                    images = []
+                    for tile in tiles:
+                        images.append(await loop.run_in_executor(self.executor, self.icon_loader.render_sheet,
+                                                                 keys, icon_size, tile))
+                    self.images[sheet] = images if event['tiled'] else images[0]
+                    yield {'event': 'icons', 'sheet': sheet}
+            yield {'event': 'done'}
+        finally:
+            # also reached when the consumer is cancelled or stops iterating early, a pending recv
+            # then fails once the worker is gone and leaves the pipe to be closed with it
+            await self.terminate()
+            if not receiving:
+                receiver.close()
+
+    async def terminate(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.process.join)
+
+    def cancel(self):
+        # for callers outside the event loop, this blocks until the worker is gone
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+    async def generate(self):
+        async for event in self:
+            pass
+        return self.images.get('group.png'), self.images.get('tech.png'), self.images.get('small.png'), self.result
+
+    async def generate_and_dump(self, dir, formats=('json',)):
+        async for event in self:
+            pass
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.dump, dir, formats)
+
+    def dump(self, dir, formats=('json',)):
+        DataExtractor.check_dump(self.result, self.sections is not None)
+        os.makedirs(dir, exist_ok=True)
+        if 'json' in formats:
+            with open(os.path.join(dir, 'info.json'), 'w', encoding='utf-8') as f:
+                json.dump(self.result, f, indent=2)
+        if 'columnar' in formats:
+            with open(os.path.join(dir, 'info.bin'), 'wb') as f:
+                columnar.dump(self.result, f)
+        for file, image in DataExtractor.get_sheet_files(self.images).items():
+            image.save(os.path.join(dir, file))
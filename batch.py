@@ -0,0 +1,104 @@
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from generate import DataExtractor
+from load import LocaleProvider, ModManager, ModRegistry, PropertyTree
+from prototype import IconLoader
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+BatchJob = collections.namedtuple('BatchJob', ['game_dir', 'mods_dir', 'settings', 'difficulty', 'dir'])
+
+_batch_context = None
+
+
+def _init_batch_worker(cache_dir, memory_limit):
+    global _batch_context
+    if memory_limit is not None and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    _batch_context = cache_dir
+
+
+def _run_batch_job(index, job):
+    cache_dir = _batch_context
+    report = {'index': index, 'dir': job.dir, 'status': 'ok', 'timings': {}}
+    start = time.perf_counter()
+    try:
+        registry = None
+        icon_cache_dir = None
+        locale_cache_dir = None
+        if cache_dir is not None:
+            registry = ModRegistry(os.path.join(cache_dir, 'mods.json'))
+            icon_cache_dir = os.path.join(cache_dir, 'icons')
+            locale_cache_dir = os.path.join(cache_dir, 'locale')
+        mod_manager = ModManager(job.game_dir, job.mods_dir, registry)
+        settings = job.settings
+        if settings is None:
+            settings = os.path.join(job.mods_dir, 'mod-settings.dat')
+        mod_settings = PropertyTree.load_mod_settings(settings)
+        report['timings']['mods'] = time.perf_counter() - start
+        locale_start = time.perf_counter()
+        locale_provider = LocaleProvider('zh-CN', 'en', mod_manager, cache_dir=locale_cache_dir)
+        report['timings']['locale'] = time.perf_counter() - locale_start
+        data_extractor = DataExtractor(job.game_dir, job.mods_dir, job.difficulty, mod_settings=mod_settings,
+                                       mod_manager=mod_manager, locale_provider=locale_provider,
+                                       icon_loader=IconLoader(mod_manager, icon_cache_dir))
+        data_extractor.generate_and_dump(job.dir)
+        for stage, seconds in data_extractor.timings.items():
+            if stage != 'mods':
+                report['timings'][stage] = seconds
+    except MemoryError:
+        report['status'] = 'out of memory'
+    except Exception:
+        report['status'] = 'failed'
+        report['error'] = traceback.format_exc()
+    report['timings']['total'] = time.perf_counter() - start
+    return report
+
+
+class BatchDumper:
+    def __init__(self, processes=None, cache_dir=None, memory_limit=None):
+        self.processes = processes or os.cpu_count() or 1
+        self.cache_dir = cache_dir
+        self.memory_limit = memory_limit
+        if cache_dir is not None:
+            os.makedirs(os.path.join(cache_dir, 'icons'), exist_ok=True)
+            os.makedirs(os.path.join(cache_dir, 'locale'), exist_ok=True)
+
+    def run(self, jobs):
+        jobs = [BatchJob(*job) if not isinstance(job, BatchJob) else job for job in jobs]
+        # every job runs in a fresh worker process so that its memory is returned to the system
+        with multiprocessing.Pool(min(self.processes, max(len(jobs), 1)),
+                                  initializer=_init_batch_worker,
+                                  initargs=(self.cache_dir, self.memory_limit),
+                                  maxtasksperchild=1) as pool:
+            results = [pool.apply_async(_run_batch_job, (i, job)) for i, job in enumerate(jobs)]
+            return [result.get() for result in results]
+
+    @staticmethod
+    def print_report(reports):
+        for report in reports:
+            timings = ' '.join('%s=%.2fs' % (k, v) for k, v in report['timings'].items())
+            print('[%d] %s %s %s' % (report['index'], report['dir'], report['status'], timings))
+            if 'error' in report:
+                print(report['error'])
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], encoding='utf-8') as f:
+        config = json.load(f)
+    memory_limit = config.get('memory_limit_mb')
+    if memory_limit is not None:
+        memory_limit *= 1024 * 1024
+    dumper = BatchDumper(config.get('processes'), config.get('cache_dir'), memory_limit)
+    jobs = [BatchJob(j['game_dir'], j['mods_dir'], j.get('settings'), j.get('difficulty', 'normal'), j['dir'])
+            for j in config['jobs']]
+    BatchDumper.print_report(dumper.run(jobs))
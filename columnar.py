@@ -0,0 +1,353 @@
+import array
+import json
+import struct
+import sys
+
+# info.bin layout, all numbers little-endian:
+#   b'FDCB' | u32 version | u32 header length | header json | columns, each aligned to 8 bytes
+# The header maps every column name to (type code, offset, length) and describes how the
+# sections of info.json are laid out over the columns. Strings are stored once in a string
+# table and referenced everywhere else by their index. Numbers are stored as doubles, with
+# a flag column <name>/int next to the columns holding integers so that they are read back
+# as integers. Module limitations are stored once per distinct set, together with one
+# bitmap per set over a recipe index for membership checks.
+
+MAGIC = b'FDCB'
+VERSION = 2
+TYPE_CODES = {'B': 1, 'I': 4, 'i': 4, 'd': 8}
+
+
+class ColumnarWriter:
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.columns = {}
+
+    def intern(self, s):
+        if s not in self.string_ids:
+            self.string_ids[s] = len(self.strings)
+            self.strings.append(s)
+        return self.string_ids[s]
+
+    def add_column(self, name, type_code, values):
+        assert name not in self.columns, name
+        self.columns[name] = array.array(type_code, values)
+
+    def add_numbers(self, name, values):
+        values = list(values)
+        self.add_column(name, 'd', values)
+        if any(type(v) == int for v in values):
+            self.add_column(name+'/int', 'B', [type(v) == int for v in values])
+
+    def add_strings(self, name, values):
+        self.add_column(name, 'I', [self.intern(v) for v in values])
+
+    def add_offsets(self, name, lists):
+        offsets = [0]
+        for values in lists:
+            offsets.append(offsets[-1] + len(values))
+        self.add_column(name, 'I', offsets)
+
+    def encode_recipe_attr(self, path, value):
+        recipes = list(value.values())
+        self.add_strings(path+'/name', [r['name'] for r in recipes])
+        self.add_strings(path+'/category', [r['category'] for r in recipes])
+        self.add_numbers(path+'/time', [r['time'] for r in recipes])
+        self.add_offsets(path+'/products', [r['products'] for r in recipes])
+        self.add_strings(path+'/product_material', [p[0] for r in recipes for p in r['products']])
+        self.add_numbers(path+'/product_amount', [p[1] for r in recipes for p in r['products']])
+        self.add_offsets(path+'/ingredients', [r['ingredients'] for r in recipes])
+        alternatives = [a for r in recipes for a in r['ingredients']]
+        self.add_offsets(path+'/alternatives', alternatives)
+        self.add_strings(path+'/ingredient_material', [i[0] for a in alternatives for i in a])
+        self.add_numbers(path+'/ingredient_amount', [i[1] for a in alternatives for i in a])
+        return {'kind': 'recipe_attr', 'path': path}
+
+    def encode_machine_attr(self, path, value):
+        machines = list(value.values())
+        self.add_strings(path+'/name', [m['name'] for m in machines])
+        self.add_numbers(path+'/speed', [m['speed'] for m in machines])
+        for field in ('module', 'in', 'in_fluid', 'out_fluid'):
+            self.add_column(path+'/'+field, 'i', [int(m[field]) for m in machines])
+        self.add_strings(path+'/fixed', [m['fixed'] for m in machines])
+        self.add_numbers(path+'/base_prod', [m['base_prod'] for m in machines])
+        self.add_offsets(path+'/effects', [m['effects'] for m in machines])
+        self.add_strings(path+'/effect_values', [e for m in machines for e in m['effects']])
+        return {'kind': 'machine_attr', 'path': path}
+
+    def add_bitmaps(self, path, recipes, sets):
+        width = (len(recipes) + 31) // 32
+        words = [0] * (width * len(sets))
+        for i, positions in enumerate(sets):
+            for position in positions:
+                words[i * width + position // 32] |= 1 << position % 32
+        self.add_strings(path+'/recipes', recipes)
+        self.add_column(path+'/bits', 'I', words)
+        return width
+
+    def encode_module_attr(self, path, value):
+        modules = list(value.values())
+        limitations = [m['limitation'] for m in modules]
+        layout = {'kind': 'module_attr', 'path': path, 'sets': 'limitation_sets'}
+        if all(type(l) == int for l in limitations):
+            # compact dumps refer to the limitation_sets section
+            ids = limitations
+            layout['compact'] = True
+        elif all(isinstance(l, list) for l in limitations):
+            ids = []
+            sets = []
+            set_ids = {}
+            for limitation in limitations:
+                if not limitation:
+                    ids.append(-1)
+                    continue
+                if tuple(limitation) not in set_ids:
+                    set_ids[tuple(limitation)] = len(sets)
+                    sets.append(limitation)
+                ids.append(set_ids[tuple(limitation)])
+            self.add_offsets(path+'/sets', sets)
+            self.add_strings(path+'/set_values', [r for l in sets for r in l])
+            recipes = sorted(set(r for l in sets for r in l))
+            index = {r: i for i, r in enumerate(recipes)}
+            layout['width'] = self.add_bitmaps(path, recipes, [[index[r] for r in l] for l in sets])
+            layout['sets'] = path
+            layout['compact'] = False
+        else:
+            return self.encode_json(path, value)
+        self.add_strings(path+'/name', [m['name'] for m in modules])
+        effects = sorted(set(e for m in modules for e in m['effects']))
+        for effect in effects:
+            self.add_numbers(path+'/effect/'+effect, [m['effects'].get(effect, 0) for m in modules])
+        self.add_column(path+'/limitation', 'i', ids)
+        layout['effects'] = effects
+        return layout
+
+    def encode_limitation_sets(self, path, value):
+        sets = []
+        for mask in value['sets']:
+            mask = int(mask, 16)
+            sets.append([i for i in range(mask.bit_length()) if mask >> i & 1])
+        width = self.add_bitmaps(path, value['recipes'], sets)
+        return {'kind': 'limitation_sets', 'path': path, 'width': width, 'count': len(sets)}
+
+    def encode_recipe_matrix(self, path, value):
+        # solvers can map indptr, indices and values straight from the buffer
+        self.add_strings(path+'/materials', value['materials'])
+        self.add_strings(path+'/recipes', value['recipes'])
+        self.add_column(path+'/indptr', 'I', value['indptr'])
+        self.add_column(path+'/indices', 'I', value['indices'])
+        self.add_numbers(path+'/values', value['values'])
+        return {'kind': 'recipe_matrix', 'path': path}
+
+    def encode_json(self, path, value):
+        self.add_column(path, 'B', json.dumps(value, separators=(',', ':')).encode('utf-8'))
+        return {'kind': 'json', 'path': path}
+
+    def encode(self, path, value, top_level=False):
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            self.add_strings(path, value)
+            return {'kind': 'string_list', 'path': path}
+        if not isinstance(value, dict) or not value:
+            return self.encode_json(path, value)
+        values = list(value.values())
+        if all(isinstance(v, str) for v in values):
+            self.add_strings(path+'/keys', value.keys())
+            self.add_strings(path+'/values', values)
+            return {'kind': 'string_map', 'path': path}
+        if all(isinstance(v, (list, tuple)) and all(isinstance(x, str) for x in v) for v in values):
+            self.add_strings(path+'/keys', value.keys())
+            self.add_offsets(path+'/offsets', values)
+            self.add_strings(path+'/values', [x for v in values for x in v])
+            return {'kind': 'string_list_map', 'path': path}
+        if all(isinstance(v, (list, tuple)) and len(v) == len(values[0]) and
+               all(type(x) == int and 0 <= x < 2**32 for x in v) for v in values):
+            self.add_strings(path+'/keys', value.keys())
+            self.add_column(path+'/values', 'I', [x for v in values for x in v])
+            return {'kind': 'int_tuple_map', 'path': path, 'width': len(values[0])}
+        if top_level or all(isinstance(v, dict) for v in values):
+            return {'kind': 'object', 'fields': {k: self.encode(path+'/'+k, v) for k, v in value.items()}}
+        return self.encode_json(path, value)
+
+    def write(self, result, fd):
+        encoders = {
+            'recipe_attr': self.encode_recipe_attr,
+            'machine_attr': self.encode_machine_attr,
+            'module_attr': self.encode_module_attr,
+            'limitation_sets': self.encode_limitation_sets,
+            'recipe_matrix': self.encode_recipe_matrix,
+        }
+        sections = {}
+        for name, value in result.items():
+            if name in encoders:
+                sections[name] = encoders[name](name, value)
+            else:
+                sections[name] = self.encode(name, value, top_level=True)
+        string_data = [s.encode('utf-8') for s in self.strings]
+        self.add_offsets('strings/offsets', string_data)
+        self.add_column('strings/data', 'B', b''.join(string_data))
+
+        columns = {}
+        offset = 0
+        for name, column in self.columns.items():
+            columns[name] = (column.typecode, offset, len(column))
+            offset += (len(column) * column.itemsize + 7) // 8 * 8
+        header = json.dumps({'sections': sections, 'columns': columns}, separators=(',', ':')).encode('utf-8')
+        header += b' ' * ((-len(header) - 12) % 8)
+        fd.write(MAGIC + struct.pack('<II', VERSION, len(header)) + header)
+        for column in self.columns.values():
+            if sys.byteorder != 'little' and column.itemsize > 1:
+                column = array.array(column.typecode, column)
+                column.byteswap()
+            data = column.tobytes()
+            fd.write(data + b'\0' * ((-len(data)) % 8))
+
+
+def dump(result, fd):
+    ColumnarWriter().write(result, fd)
+
+
+class ColumnarReader:
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+        assert bytes(self.buffer[:4]) == MAGIC, "Not a columnar dump"
+        version, header_length = struct.unpack('<II', self.buffer[4:12])
+        assert version == VERSION, "Unsupported columnar dump version " + str(version)
+        header = json.loads(bytes(self.buffer[12:12+header_length]).decode('utf-8'))
+        self.base = 12 + header_length
+        self.sections = header['sections']
+        self.column_info = header['columns']
+        self._strings = None
+        self._string_ids = None
+        self._limitations = None
+
+    def column(self, name):
+        type_code, offset, length = self.column_info[name]
+        start = self.base + offset
+        view = self.buffer[start:start + length * TYPE_CODES[type_code]]
+        if sys.byteorder != 'little' and TYPE_CODES[type_code] > 1:
+            values = array.array(type_code, view.tobytes())
+            values.byteswap()
+            return values
+        return view.cast(type_code)
+
+    @property
+    def strings(self):
+        if self._strings is None:
+            offsets = self.column('strings/offsets')
+            data = bytes(self.column('strings/data'))
+            self._strings = [data[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(len(offsets) - 1)]
+        return self._strings
+
+    def string_id(self, s):
+        if self._string_ids is None:
+            self._string_ids = {s: i for i, s in enumerate(self.strings)}
+        return self._string_ids.get(s)
+
+    def numbers(self, name):
+        values = self.column(name).tolist()
+        if name+'/int' in self.column_info:
+            for i, flag in enumerate(self.column(name+'/int')):
+                if flag:
+                    values[i] = int(values[i])
+        return values
+
+    def _strings_of(self, name):
+        strings = self.strings
+        return [strings[i] for i in self.column(name)]
+
+    @staticmethod
+    def _split(values, offsets):
+        return [values[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)]
+
+    def decode(self, layout):
+        kind = layout['kind']
+        path = layout.get('path')
+        if kind == 'json':
+            return json.loads(bytes(self.column(path)).decode('utf-8'))
+        if kind == 'string_list':
+            return self._strings_of(path)
+        if kind == 'string_map':
+            return dict(zip(self._strings_of(path+'/keys'), self._strings_of(path+'/values')))
+        if kind == 'string_list_map':
+            values = self._split(self._strings_of(path+'/values'), self.column(path+'/offsets'))
+            return dict(zip(self._strings_of(path+'/keys'), values))
+        if kind == 'int_tuple_map':
+            width = layout['width']
+            values = self.column(path+'/values').tolist()
+            return {k: values[i*width:(i+1)*width] for i, k in enumerate(self._strings_of(path+'/keys'))}
+        if kind == 'object':
+            return {k: self.decode(v) for k, v in layout['fields'].items()}
+        if kind == 'recipe_attr':
+            names = self._strings_of(path+'/name')
+            products = self._split([[m, a] for m, a in zip(self._strings_of(path+'/product_material'),
+                                                           self.numbers(path+'/product_amount'))],
+                                   self.column(path+'/products'))
+            entries = [[m, a] for m, a in zip(self._strings_of(path+'/ingredient_material'),
+                                              self.numbers(path+'/ingredient_amount'))]
+            alternatives = self._split(entries, self.column(path+'/alternatives'))
+            ingredients = self._split(alternatives, self.column(path+'/ingredients'))
+            return {name: {'name': name, 'category': category, 'time': time, 'products': p, 'ingredients': i}
+                    for name, category, time, p, i in zip(names, self._strings_of(path+'/category'),
+                                                          self.numbers(path+'/time'), products, ingredients)}
+        if kind == 'machine_attr':
+            names = self._strings_of(path+'/name')
+            effects = self._split(self._strings_of(path+'/effect_values'), self.column(path+'/effects'))
+            columns = {f: self.numbers(path+'/'+f)
+                       for f in ('speed', 'module', 'in', 'in_fluid', 'out_fluid', 'base_prod')}
+            fixed = self._strings_of(path+'/fixed')
+            return {name: {'name': name, 'speed': columns['speed'][i], 'module': columns['module'][i],
+                           'effects': effects[i], 'in': columns['in'][i], 'in_fluid': columns['in_fluid'][i],
+                           'out_fluid': columns['out_fluid'][i], 'fixed': fixed[i],
+                           'base_prod': columns['base_prod'][i]}
+                    for i, name in enumerate(names)}
+        if kind == 'module_attr':
+            names = self._strings_of(path+'/name')
+            effects = {e: self.numbers(path+'/effect/'+e) for e in layout['effects']}
+            limitation = self.column(path+'/limitation').tolist()
+            if not layout['compact']:
+                sets = self._split(self._strings_of(path+'/set_values'), self.column(path+'/sets'))
+                limitation = [sets[i] if i >= 0 else [] for i in limitation]
+            return {name: {'name': name, 'effects': {e: v[i] for e, v in effects.items()}, 'limitation': limitation[i]}
+                    for i, name in enumerate(names)}
+        if kind == 'limitation_sets':
+            width = layout['width']
+            words = self.column(path+'/bits').tolist()
+            sets = []
+            for i in range(layout['count']):
+                mask = 0
+                for j, word in enumerate(words[i*width:(i+1)*width]):
+                    mask |= word << 32 * j
+                sets.append(format(mask, 'x'))
+            return {'recipes': self._strings_of(path+'/recipes'), 'sets': sets}
+        if kind == 'recipe_matrix':
+            return {'materials': self._strings_of(path+'/materials'), 'recipes': self._strings_of(path+'/recipes'),
+                    'indptr': self.column(path+'/indptr').tolist(), 'indices': self.column(path+'/indices').tolist(),
+                    'values': self.numbers(path+'/values')}
+        raise ValueError('Unknown column layout ' + kind)
+
+    def module_allows(self, module, recipe):
+        if self._limitations is None:
+            layout = self.sections['module_attr']
+            sets = self.sections[layout['sets']]
+            modules = dict(zip(self._strings_of(layout['path']+'/name'), self.column(layout['path']+'/limitation')))
+            recipes = {r: i for i, r in enumerate(self._strings_of(sets['path']+'/recipes'))}
+            self._limitations = modules, recipes, self.column(sets['path']+'/bits'), sets['width']
+        modules, recipes, bits, width = self._limitations
+        set_id = modules[module]
+        if set_id < 0:
+            return True
+        if recipe not in recipes:
+            return False
+        i = recipes[recipe]
+        return bool(bits[set_id * width + i // 32] >> i % 32 & 1)
+
+    def section(self, name):
+        return self.decode(self.sections[name])
+
+    def to_dict(self):
+        return {name: self.section(name) for name in self.sections}
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return ColumnarReader(f.read())
@@ -1,47 +1,272 @@
 import collections
+import columnar
+import concurrent.futures
+import heapq
 import itertools
+import multiprocessing
 import platform
+import sys
+import time
+import traceback
 from pathlib import Path
 from load import *
 from prototype import *
+from validate import validate_info
+
+
+_variant_context = None
+
+
+def _create_variant_context(game_dir, mods_dir):
+    mod_manager = ModManager(game_dir, mods_dir)
+    return mod_manager, LocaleProvider('zh-CN', 'en', mod_manager), IconLoader(mod_manager)
+
+
+def _init_variant_worker(game_dir, mods_dir, context=None):
+    # only pool workers use the global, forked workers get the warm context of their parent
+    global _variant_context
+    if context is None:
+        context = _create_variant_context(game_dir, mods_dir)
+    else:
+        context[0].reopen()
+    _variant_context = context
+
+
+def _generate_variant(game_dir, mods_dir, difficulty, settings_file, dir, extras=(), context=None):
+    mod_manager, locale_provider, icon_loader = context or _variant_context
+    mod_settings = PropertyTree.load_mod_settings(settings_file)
+    data_extractor = DataExtractor(game_dir, mods_dir, difficulty, mod_settings=mod_settings,
+                                   mod_manager=mod_manager, locale_provider=locale_provider,
+                                   icon_loader=icon_loader)
+    data_extractor.generate_and_dump(dir, extras)
+    return dir
 
 
 class DataExtractor:
-    def __init__(self, game_dir, mods_dir, difficulty):
+    optional_sections = {
+        'material_index': 'get_material_index',
+        'recipe_matrix': 'get_recipe_matrix',
+        'tech_closure': 'get_tech_closure',
+        'machine_recipes': 'get_machine_recipes',
+    }
+    # every derived structure is a stage, computed once by get_stage and shared by everything that needs it
+    stages = {
+        'fluid_temperature': 'resolve_fluid_temperature',
+        'material_order': 'get_material_orders',
+        'material_list': 'get_material_list',
+        'recipe_list': 'get_recipe_list',
+        'resource_list': 'get_resource_list',
+        'module_list': 'get_module_list',
+        'machine_list': 'get_machine_list',
+        'icon_sheets': 'get_icon_sheets',
+        'icons': 'get_icons',
+        'order_info': 'get_order_info',
+        'free_fluids': 'get_free_fluids',
+        'unlockable_recipes': 'get_unlockable_recipes',
+        'icon_mapping': 'get_icon_mapping',
+        'localised_names': 'get_localised_names',
+        'machine_attr': 'get_machine_attr',
+        'module_attr': 'get_module_attr',
+        'temperature_attr': 'get_temperature_attr',
+        'recipe_attr': 'get_recipe_attr',
+        'limitation_index': 'get_limitation_index',
+        'limitation_sets': 'get_limitation_sets',
+    }
+    standard_sections = ('order_info', 'free_fluids', 'unlockable_recipes', 'icon_mapping', 'localised_names',
+                         'machine_attr', 'module_attr', 'temperature_attr', 'recipe_attr')
+    icon_sheets = ('group.png', 'tech.png', 'small.png')
+    # the prototype collections every output is computed from
+    section_prototypes = {
+        'order_info': ('items', 'fluids', 'item_groups', 'item_subgroups', 'recipes', 'resources', 'modules',
+                       'crafting_machines', 'mining_drills'),
+        'free_fluids': ('offshore_pumps',),
+        'unlockable_recipes': ('recipes', 'techs', 'resources'),
+        'icon_mapping': (),
+        'localised_names': ('items', 'fluids', 'techs', 'item_groups', 'recipes', 'resources', 'mining_drills',
+                            'crafting_machines', 'offshore_pumps'),
+        'machine_attr': ('crafting_machines', 'mining_drills'),
+        'module_attr': ('modules', 'resources'),
+        'temperature_attr': ('fluids', 'recipes'),
+        'recipe_attr': ('items', 'fluids', 'item_groups', 'item_subgroups', 'recipes', 'resources'),
+        'material_index': ('items', 'fluids', 'item_groups', 'item_subgroups', 'recipes', 'resources'),
+        'recipe_matrix': ('items', 'fluids', 'item_groups', 'item_subgroups', 'recipes', 'resources'),
+        'tech_closure': ('techs', 'recipes'),
+        'machine_recipes': ('recipes', 'resources', 'crafting_machines', 'mining_drills'),
+        'group.png': ('item_groups',),
+        'tech.png': ('techs',),
+        'small.png': ('items', 'fluids', 'recipes', 'resources', 'mining_drills', 'crafting_machines',
+                      'offshore_pumps'),
+    }
+    prototype_dependencies = {
+        'recipes': ('items', 'fluids'),
+        'resources': ('fluids',),
+    }
+    item_types = ('item', 'ammo', 'capsule', 'gun', 'module', 'tool', 'armor', 'mining-tool', 'repair-tool',
+                  'item-with-entity-data', 'rail-planner', 'item-with-label', 'item-with-inventory', 'item-with-tags',
+                  'deconstruction-item', 'upgrade-item', 'blueprint', 'blueprint-book')
+
+    def __init__(self, game_dir, mods_dir, difficulty, mod_settings=None,
+                 mod_manager=None, locale_provider=None, icon_loader=None, chunk_cache=None, lua_options=None,
+                 sections=None, progress=None, max_atlas_size=None, group_atlases=False, compact_limitations=False,
+                 lua_loader=None):
         self.game_dir = game_dir
         self.mods_dir = mods_dir
-        self.mod_manager = ModManager(game_dir, mods_dir)
-        self.mod_settings = PropertyTree.load_mod_settings(os.path.join(mods_dir, 'mod-settings.dat'))
-        self.lua_loader = LuaLoader(self.mod_manager, self.mod_settings)
-        self.locale_provider = LocaleProvider('zh-CN', 'en', self.mod_manager)
-        self.icon_loader = IconLoader(self.mod_manager)
+        self.timings = {}
+        self.stage_results = {}
+        self.stage_timings = {}
+        self.stage_graph = {}
+        self.stage_stack = []
+        self.progress = progress
+        # tiled atlases are saved as <sheet>-<index>.png and their icon_mapping entries start with the tile index
+        self.max_atlas_size = max_atlas_size
+        self.group_atlases = group_atlases
+        self.tiled_atlases = max_atlas_size is not None or group_atlases
+        # module_attr then refers to the limitation_sets section by index instead of listing every recipe
+        self.compact_limitations = compact_limitations
+        self.sections = None
+        if sections is not None:
+            self.sections = set(sections)
+            known = set(DataExtractor.standard_sections) | set(DataExtractor.optional_sections) | \
+                set(DataExtractor.icon_sheets)
+            assert self.sections <= known, "Unknown sections " + str(self.sections - known)
+        start = time.perf_counter()
+        self.mod_manager = mod_manager or ModManager(game_dir, mods_dir)
+        if mod_settings is None:
+            mod_settings = PropertyTree.load_mod_settings(os.path.join(mods_dir, 'mod-settings.dat'))
+        self.mod_settings = mod_settings
+        self.timings['mods'] = time.perf_counter() - start
+        start = time.perf_counter()
+        if lua_loader is None:
+            lua_loader = LuaLoader(self.mod_manager, self.mod_settings, chunk_cache, progress=progress,
+                                   **(lua_options or {}))
+        assert lua_loader.complete, "The lua loader stopped at a checkpoint and was not resumed"
+        self.lua_loader = lua_loader
+        self.timings['lua'] = time.perf_counter() - start
+        # the locale is only loaded once a localised name is asked for
+        self._locale_provider = locale_provider
+        self.icon_loader = icon_loader or IconLoader(self.mod_manager)
+
+        start = time.perf_counter()
+        self.icon_registry = IconRegistry(self.icon_loader)
+        prototypes = self.get_required_prototypes()
+        icon_prototypes = self.get_icon_prototypes()
+
+        def icon_registry_for(kind):
+            return self.icon_registry if kind in icon_prototypes else None
 
         dataraw = self.lua_loader.get_dataraw()
         self.items = {}
-        for t in ('item', 'ammo', 'capsule', 'gun', 'module', 'tool', 'armor', 'mining-tool', 'repair-tool', 'item-with-entity-data', 'rail-planner', 'item-with-label', 'item-with-inventory', 'item-with-tags', 'deconstruction-item', 'upgrade-item', 'blueprint', 'blueprint-book'):
-            for i in dataraw[t]:
-                self.items[i] = Item(dataraw[t][i], self.icon_loader)
-        self.fluids = {f: Fluid(dataraw['fluid'][f], self.icon_loader) for f in dataraw['fluid']}
-        self.techs = {t: Technology(dataraw['technology'][t], self.icon_loader, difficulty) for t in dataraw['technology']}
-        self.item_groups = {g: ItemGroup(dataraw['item-group'][g], self.icon_loader) for g in dataraw['item-group']}
-        self.item_subgroups = {g: ItemSubGroup(dataraw['item-subgroup'][g]) for g in dataraw['item-subgroup']}
-        self.recipes = {r: Recipe(dataraw['recipe'][r], self.icon_loader, difficulty, self.items, self.fluids) for r in dataraw['recipe']}
+        if 'items' in prototypes:
+            for t in DataExtractor.item_types:
+                for i in dataraw[t]:
+                    self.items[i] = Item(dataraw[t][i], icon_registry_for('items'))
+        self.fluids = {}
+        if 'fluids' in prototypes:
+            self.fluids = {f: Fluid(dataraw['fluid'][f], icon_registry_for('fluids')) for f in dataraw['fluid']}
+        self.techs = {}
+        if 'techs' in prototypes:
+            self.techs = {t: Technology(dataraw['technology'][t], icon_registry_for('techs'), difficulty)
+                          for t in dataraw['technology']}
+        self.item_groups = {}
+        if 'item_groups' in prototypes:
+            self.item_groups = {g: ItemGroup(dataraw['item-group'][g], icon_registry_for('item_groups'))
+                                for g in dataraw['item-group']}
+        self.item_subgroups = {}
+        if 'item_subgroups' in prototypes:
+            self.item_subgroups = {g: ItemSubGroup(dataraw['item-subgroup'][g]) for g in dataraw['item-subgroup']}
+        self.recipes = {}
+        if 'recipes' in prototypes:
+            self.recipes = {r: Recipe(dataraw['recipe'][r], icon_registry_for('recipes'), difficulty, self.items,
+                                      self.fluids)
+                            for r in dataraw['recipe']}
         self.resources = {}
-        for r in dataraw['resource']:
-            self.resources[r] = Resource(dataraw['resource'][r], self.icon_loader, self.fluids)
+        if 'resources' in prototypes:
+            for r in dataraw['resource']:
+                self.resources[r] = Resource(dataraw['resource'][r], icon_registry_for('resources'), self.fluids)
         self.mining_drills = {}
-        for d in dataraw['mining-drill']:
-            self.mining_drills[d] = MiningDrill(dataraw['mining-drill'][d], self.icon_loader)
+        if 'mining_drills' in prototypes:
+            for d in dataraw['mining-drill']:
+                self.mining_drills[d] = MiningDrill(dataraw['mining-drill'][d], icon_registry_for('mining_drills'))
         self.crafting_machines = {}
-        for t in ('assembling-machine', 'rocket-silo', 'furnace'):
-            for e in dataraw[t]:
-                self.crafting_machines[e] = CraftingMachine(dataraw[t][e], self.icon_loader)
+        if 'crafting_machines' in prototypes:
+            for t in ('assembling-machine', 'rocket-silo', 'furnace'):
+                for e in dataraw[t]:
+                    self.crafting_machines[e] = CraftingMachine(dataraw[t][e], icon_registry_for('crafting_machines'))
         self.offshore_pumps = {}
-        for p in dataraw['offshore-pump']:
-            self.offshore_pumps[p] = OffshorePump(dataraw['offshore-pump'][p], self.icon_loader)
+        if 'offshore_pumps' in prototypes:
+            for p in dataraw['offshore-pump']:
+                self.offshore_pumps[p] = OffshorePump(dataraw['offshore-pump'][p], icon_registry_for('offshore_pumps'))
         self.modules = {}
-        for m in dataraw['module']:
-            self.modules[m] = Module(dataraw['module'][m], self.icon_loader)
+        if 'modules' in prototypes:
+            for m in dataraw['module']:
+                self.modules[m] = Module(dataraw['module'][m], icon_registry_for('modules'))
+        self.timings['prototypes'] = time.perf_counter() - start
+        self.report_progress({'event': 'prototypes', 'seconds': self.timings['prototypes']})
+
+    @property
+    def locale_provider(self):
+        if self._locale_provider is None:
+            start = time.perf_counter()
+            self._locale_provider = LocaleProvider('zh-CN', 'en', self.mod_manager)
+            self.timings['locale'] = time.perf_counter() - start
+        return self._locale_provider
+
+    def get_stage(self, name):
+        if self.stage_stack:
+            dependencies = self.stage_graph[self.stage_stack[-1][0]]
+            if name not in dependencies:
+                dependencies.append(name)
+        if name not in self.stage_results:
+            assert name not in [n for n, nested in self.stage_stack], "Cyclic stage " + name
+            method = DataExtractor.stages.get(name) or DataExtractor.optional_sections[name]
+            self.stage_graph[name] = []
+            frame = [name, 0]
+            self.stage_stack.append(frame)
+            start = time.perf_counter()
+            try:
+                result = getattr(self, method)()
+            finally:
+                self.stage_stack.pop()
+            seconds = time.perf_counter() - start
+            # a stage is timed without the stages it computed on the way
+            self.stage_timings[name] = seconds - frame[1]
+            if self.stage_stack:
+                self.stage_stack[-1][1] += seconds
+            self.stage_results[name] = result
+            self.report_progress({'event': 'stage', 'stage': name, 'seconds': self.stage_timings[name]})
+        return self.stage_results[name]
+
+    def report_progress(self, event):
+        if self.progress is not None:
+            self.progress(event)
+
+    def wants(self, section):
+        return self.sections is None or section in self.sections
+
+    @staticmethod
+    def add_prototype_dependencies(prototypes):
+        for kind in list(prototypes):
+            prototypes.update(DataExtractor.prototype_dependencies.get(kind, ()))
+        return prototypes
+
+    def get_required_prototypes(self):
+        prototypes = set()
+        for section, kinds in DataExtractor.section_prototypes.items():
+            if self.wants(section):
+                prototypes.update(kinds)
+        if self.compact_limitations and self.wants('module_attr'):
+            prototypes.add('recipes')
+        return DataExtractor.add_prototype_dependencies(prototypes | self.get_icon_prototypes())
+
+    def get_icon_prototypes(self):
+        # icon_mapping needs the names in every sheet, recipes without an icon borrow the one of their product
+        prototypes = set()
+        for sheet in DataExtractor.icon_sheets:
+            if self.wants(sheet) or self.wants('icon_mapping'):
+                prototypes.update(DataExtractor.section_prototypes[sheet])
+        if self.group_atlases and prototypes:
+            prototypes.update(('item_groups', 'item_subgroups'))
+        return DataExtractor.add_prototype_dependencies(prototypes)
 
     def resolve_fluid_temperature(self):
         for fluid in self.fluids.values():
@@ -177,15 +402,15 @@ class DataExtractor:
 
     def get_order_info(self):
         result = {}
-        material_groups, materials = self.get_material_list()
-        recipe_groups, recipes = self.get_recipe_list()
+        material_groups, materials = self.get_stage('material_list')
+        recipe_groups, recipes = self.get_stage('recipe_list')
         result['material_group'] = material_groups
         result['recipe_group'] = recipe_groups
         result['material'] = materials
         result['recipe'] = recipes
-        result['resource'] = self.get_resource_list()
-        result['module'] = self.get_module_list()
-        result['machine'] = self.get_machine_list()
+        result['resource'] = self.get_stage('resource_list')
+        result['module'] = self.get_stage('module_list')
+        result['machine'] = self.get_stage('machine_list')
         return result
 
     def get_free_fluids(self):
@@ -207,24 +432,142 @@ class DataExtractor:
             tech = self.techs[tech]
             result = result.union(tech.unlocks)
 
-        return list(result)
+        return sorted(result)
+
+    def get_tech_order(self):
+        # prerequisites come before the technologies that need them, of the technologies that are ready
+        # the first by name goes next
+        dependants = {name: [] for name in self.techs}
+        waiting = {}
+        for name, tech in self.techs.items():
+            prerequisites = [p for p in tech.prerequisites if p in self.techs]
+            waiting[name] = len(prerequisites)
+            for prerequisite in prerequisites:
+                dependants[prerequisite].append(name)
+        ready = [name for name, count in waiting.items() if count == 0]
+        heapq.heapify(ready)
+        result = []
+        while ready:
+            name = heapq.heappop(ready)
+            result.append(name)
+            for dependant in dependants[name]:
+                waiting[dependant] -= 1
+                if waiting[dependant] == 0:
+                    heapq.heappush(ready, dependant)
+        assert len(result) == len(self.techs), \
+            "Technology prerequisites form a cycle among " + ', '.join(sorted(set(self.techs) - set(result)))
+        return result
+
+    def get_tech_closure(self):
+        # bit i of a prerequisites mask stands for technologies[i], so every technology needed before
+        # one can be researched is a single bitwise test
+        order = self.get_tech_order()
+        index = {name: i for i, name in enumerate(order)}
+        masks = []
+        for name in order:
+            mask = 0
+            for prerequisite in self.techs[name].prerequisites:
+                if prerequisite in index:
+                    mask |= masks[index[prerequisite]] | 1 << index[prerequisite]
+            masks.append(mask)
+        return {
+            'technologies': ['technology/'+name for name in order],
+            'prerequisites': [format(mask, 'x') for mask in masks],
+            'unlocks': [['recipe/'+r for r in self.techs[name].unlocks if r in self.recipes] for name in order],
+        }
 
     def get_unlockable_recipes(self):
-        return ['recipe/'+i for i in self.get_raw_unlockable_recipes()] + self.get_resource_list()
-
-    def get_icons(self):
-        group_icons, group_icon_mapping = ItemGroup.get_atlas()
-        tech_icons, tech_icon_mapping = Technology.get_atlas()
-        group_icon_mapping = {'group/'+k: v for k, v in group_icon_mapping.items()}
-        tech_icon_mapping = {'technology/'+k: v for k, v in tech_icon_mapping.items()}
-        small_icons = {'item/'+i: icon for i, icon in Item.icons.items()}
-        small_icons.update({'fluid/'+i: icon for i, icon in Fluid.icons.items()})
-        small_icons.update({'resource/'+i: icon for i, icon in Resource.icons.items()})
-        small_icons.update({'recipe/'+i: icon for i, icon in Recipe.icons.items()})
-        small_icons.update({'entity/'+i: icon for i, icon in Entity.icons.items()})
-        small_icons, small_icon_mapping = IconLoader.get_atlas(small_icons, 32)
-        return group_icons, tech_icons, small_icons,\
-            {"group": group_icon_mapping, "tech": tech_icon_mapping, "small": small_icon_mapping}
+        return ['recipe/'+i for i in self.get_raw_unlockable_recipes()] + self.get_stage('resource_list')
+
+    def get_icon_sheets(self):
+        registry = self.icon_registry
+        group_icons = {'group/'+i: key for i, key in registry.get_keys(ItemGroup.icon_type).items()}
+        tech_icons = {'technology/'+i: key for i, key in registry.get_keys(Technology.icon_type).items()}
+        small_icons = {}
+        for cls in (Item, Fluid, Resource, Recipe, Entity):
+            small_icons.update({cls.icon_type+'/'+i: key for i, key in registry.get_keys(cls.icon_type).items()})
+        # sheets are laid out by name rather than in lua table order, so the same icons give the same sheet
+        result = {
+            'group.png': (dict(sorted(group_icons.items())), ItemGroup.icon_size),
+            'tech.png': (dict(sorted(tech_icons.items())), Technology.icon_size),
+            'small.png': (dict(sorted(small_icons.items())), 32),
+        }
+        groups = self.get_icon_groups() if self.group_atlases else {}
+        for sheet, (keys, icon_size) in result.items():
+            if not self.tiled_atlases:
+                tiles = [IconLoader.get_atlas_mapping(keys)]
+            else:
+                max_cells = None
+                if self.max_atlas_size is not None:
+                    max_cells = self.max_atlas_size // icon_size
+                    assert max_cells > 0, "Maximum atlas size is smaller than a single icon"
+                sheet_groups = groups if sheet == 'small.png' else None
+                names = list(keys)
+                if sheet_groups is not None:
+                    names.sort(key=lambda name: self.get_group_order(sheet_groups.get(name)))
+                tiles = IconLoader.get_atlas_layout(names, max_cells, sheet_groups)
+            result[sheet] = keys, icon_size, tiles
+        return result
+
+    def get_icon_groups(self):
+        groups = {}
+        for prefix, prototypes in (('item/', self.items), ('fluid/', self.fluids), ('recipe/', self.recipes)):
+            for prototype in prototypes.values():
+                subgroup = self.item_subgroups.get(prototype.subgroup)
+                if subgroup is not None:
+                    groups[prefix+prototype.name] = subgroup.group
+        return groups
+
+    def get_group_order(self, group):
+        # icons outside of any item group go to the last tiles
+        if group not in self.item_groups:
+            return True, '', ''
+        return False, self.item_groups[group].order, group
+
+    def get_icons(self, sheets=None):
+        # sheets that are not asked for are never rendered, the mapping only depends on the icon names
+        if sheets is None:
+            sheets = [sheet for sheet in DataExtractor.icon_sheets if self.wants(sheet)]
+        icon_sheets = self.get_stage('icon_sheets')
+        images = []
+        for sheet in DataExtractor.icon_sheets:
+            if sheet in sheets:
+                keys, icon_size, tiles = icon_sheets[sheet]
+                tile_images = [self.icon_loader.render_sheet(keys, icon_size, tile) for tile in tiles]
+                images.append(tile_images if self.tiled_atlases else tile_images[0])
+                self.report_progress({'event': 'icons', 'sheet': sheet})
+            else:
+                images.append(None)
+        return images[0], images[1], images[2], self.get_stage('icon_mapping')
+
+    def get_icon_mapping(self):
+        icon_sheets = self.get_stage('icon_sheets')
+        result = {}
+        for name, sheet in (('group', 'group.png'), ('tech', 'tech.png'), ('small', 'small.png')):
+            tiles = icon_sheets[sheet][2]
+            if self.tiled_atlases:
+                result[name] = {icon: (i, x, y) for i, tile in enumerate(tiles) for icon, (x, y) in tile.items()}
+            else:
+                result[name] = tiles[0]
+        return result
+
+    @staticmethod
+    def get_sheet_files(sheets):
+        # maps file names to images, a tiled sheet is a list with one image per tile
+        files = {}
+        for sheet, images in sheets.items():
+            if isinstance(images, list):
+                stem, extension = os.path.splitext(sheet)
+                files.update({stem+'-'+str(i)+extension: image for i, image in enumerate(images)})
+            elif images is not None:
+                files[sheet] = images
+        return files
+
+    def release_icons(self):
+        # drops the icon keys and rendered sheets of this extraction, every other stage is kept
+        self.icon_registry.release()
+        for name in ('icon_sheets', 'icons', 'icon_mapping'):
+            self.stage_results.pop(name, None)
 
     def get_localised_names(self):
         result = {'item/'+i.name: i.get_localised_name(self.locale_provider) for i in self.items.values()}
@@ -268,8 +611,61 @@ class DataExtractor:
             result[name] = attribute
         return result
 
+    @staticmethod
+    def count_types(materials):
+        items = set(m.name for m in materials if m.type != 'fluid')
+        fluids = set(m.name for m in materials if m.type == 'fluid')
+        return len(items), len(fluids)
+
+    @staticmethod
+    def can_craft(machine, recipe):
+        if machine.fixed_recipe:
+            return machine.fixed_recipe == recipe.name
+        if recipe.category not in machine.categories:
+            return False
+        items, fluids = DataExtractor.count_types(recipe.ingredients)
+        # machines that set neither ingredient_count nor source_inventory_size take any number of items
+        if 0 <= machine.ingredient_count < items or machine.input_fluid_box < fluids:
+            return False
+        return machine.output_fluid_box >= DataExtractor.count_types(recipe.results)[1]
+
+    @staticmethod
+    def can_mine(machine, resource):
+        if resource.category not in machine.categories:
+            return False
+        if resource.fluid_amount > 0 and machine.input_fluid_box == 0:
+            return False
+        return machine.output_fluid_box >= DataExtractor.count_types(resource.results)[1]
+
+    def get_machine_recipes(self):
+        # machines follow the order of machine_list, recipes are sorted by name
+        machine_list = self.get_stage('machine_list')
+        recipes = {}
+        machines = {}
+        for kind, prototypes, machine_prototypes, check in (
+                ('recipe', self.recipes, self.crafting_machines, DataExtractor.can_craft),
+                ('resource', self.resources, self.mining_drills, DataExtractor.can_mine)):
+            category_kind = 'crafting/' if kind == 'recipe' else 'mining/'
+            for name in sorted(prototypes):
+                prototype = prototypes[name]
+                candidates = machine_list.get(category_kind+prototype.category, [])
+                if kind == 'recipe':
+                    fixed = ['entity/'+m.name for m in machine_prototypes.values() if m.fixed_recipe == name]
+                    candidates = candidates + sorted(m for m in fixed if m not in candidates)
+                eligible = [m for m in candidates if check(machine_prototypes[m[7:]], prototype)]
+                recipes[kind+'/'+name] = eligible
+                for machine in eligible:
+                    if machine not in machines:
+                        machines[machine] = []
+                    machines[machine].append(kind+'/'+name)
+        for machine in itertools.chain(self.crafting_machines, self.mining_drills):
+            if 'entity/'+machine not in machines:
+                machines['entity/'+machine] = []
+        return {'recipes': recipes, 'machines': machines}
+
     def get_module_attr(self):
         result = {}
+        resource_list = self.get_stage('resource_list')
         for module in self.modules.values():
             attribute = {}
             name = 'item/'+module.name
@@ -278,14 +674,48 @@ class DataExtractor:
             for e in ("speed", "productivity", "consumption", "pollution"):
                 effects[e] = module.effects[e]
             attribute['effects'] = effects
-            if len(module.limitation) > 0:
-                attribute['limitation'] = ['recipe/'+i for i in module.limitation] + self.get_resource_list()
+            if self.compact_limitations:
+                attribute['limitation'] = self.get_limitation_set(module)
+            elif len(module.limitation) > 0:
+                attribute['limitation'] = ['recipe/'+i for i in module.limitation] + resource_list
             else:
                 attribute['limitation'] = []
             result[name] = attribute
         return result
 
+    def get_limitation_index(self):
+        # bit i of a set stands for recipes[i], recipes that do not exist can never be limited to,
+        # modules map to the index of their set or -1 when they have no limitation
+        recipes = ['recipe/'+i for i in sorted(self.recipes)] + self.get_stage('resource_list')
+        index = {recipe: i for i, recipe in enumerate(recipes)}
+        resource_mask = 0
+        for resource in self.get_stage('resource_list'):
+            resource_mask |= 1 << index[resource]
+        sets = []
+        set_ids = {}
+        modules = {}
+        for module in sorted(self.modules.values()):
+            if len(module.limitation) == 0:
+                modules[module.name] = -1
+                continue
+            mask = resource_mask
+            for recipe in module.limitation:
+                if 'recipe/'+recipe in index:
+                    mask |= 1 << index['recipe/'+recipe]
+            if mask not in set_ids:
+                set_ids[mask] = len(sets)
+                sets.append(format(mask, 'x'))
+            modules[module.name] = set_ids[mask]
+        return {'recipes': recipes, 'sets': sets}, modules
+
+    def get_limitation_sets(self):
+        return self.get_stage('limitation_index')[0]
+
+    def get_limitation_set(self, module):
+        return self.get_stage('limitation_index')[1][module.name]
+
     def get_temperature_attr(self):
+        self.get_stage('fluid_temperature')
         result = {}
         for fluid in self.fluids.values():
             name = 'fluid/'+fluid.name
@@ -298,157 +728,292 @@ class DataExtractor:
                 result[name] = attribute
         return result
 
-    def get_recipe_attr(self):
-        def order(material):
-            temp = 0
-            if '@' in material:
-                temp = material.split('@')[1]
-                material = material.split('@')[0]
-            type_ = material.split('/')[0]
-            name_ = material.split('/')[1]
-            if type_ == 'resource':
-                resource = self.resources[name_]
-                return '', '', '', '', resource.order, resource.name, 0
-            else:
-                if type_ == 'item':
-                    item = self.items[name_]
-                else:
-                    item = self.fluids[name_]
+    def get_material_orders(self):
+        result = {}
+        for resource in self.resources.values():
+            result['resource/'+resource.name] = '', '', '', '', resource.order, resource.name
+        for type_, materials in (('item', self.items), ('fluid', self.fluids)):
+            for item in materials.values():
                 subgroup = self.item_subgroups[item.subgroup]
                 group = self.item_groups[subgroup.group]
-                return group.order_in_recipe, group.name, subgroup.order, subgroup.name, item.order, item.name, temp
+                result[type_+'/'+item.name] = \
+                    group.order_in_recipe, group.name, subgroup.order, subgroup.name, item.order, item.name
+        return result
+
+    def get_material_order(self, material):
+        temp = 0
+        if '@' in material:
+            temp = material.split('@')[1]
+            material = material.split('@')[0]
+        return self.get_stage('material_order')[material] + (temp,)
+
+    def get_products(self, results, temperature_attr):
+        products = {}
+        for product in results:
+            product_name = product.type+'/'+product.name
+            if product_name in temperature_attr:
+                number = -1
+                for i, temps in enumerate(temperature_attr[product_name]):
+                    if product.temperature in temps:
+                        number = i
+                assert number != -1
+                product_name = product_name+'@'+str(number)
+            if product_name not in products:
+                products[product_name] = 0
+            assert product.amount is not None, product_name
+            products[product_name] += product.amount
+        products = [(k, v) for k, v in products.items()]
+        products.sort(key=lambda s: self.get_material_order(s[0]))
+        return products
 
-        temperature_attr = self.get_temperature_attr()
+    def get_single_recipe_attr(self, recipe, temperature_attr):
+        attribute = {}
+        name = 'recipe/'+recipe.name
+        category = 'crafting/'+recipe.category
+        time = recipe.energy_required
+        products = self.get_products(recipe.results, temperature_attr)
+        ingredients = []
+        for ingredient in recipe.ingredients:
+            ingredient_name = ingredient.type+'/'+ingredient.name
+            if ingredient_name in temperature_attr:
+                numbers = []
+                for i, temps in enumerate(temperature_attr[ingredient_name]):
+                    if len(temps) == 0 or ingredient.minimum_temperature <= temps[0] <= ingredient.maximum_temperature:
+                        numbers.append(i)
+                ingredients.append([(ingredient_name+'@'+str(i), ingredient.amount) for i in numbers])
+                if len(numbers) == 0:
+                    return None
+            elif not ingredient_name.startswith('fluid/') \
+                    or any(ingredient.minimum_temperature <= temp <= ingredient.maximum_temperature
+                           for temp in self.fluids[ingredient_name[6:]].available_temperatures):
+                ingredients.append([(ingredient_name, ingredient.amount)])
+            else:
+                return None
+        ingredients.sort(key=lambda s: self.get_material_order(s[0][0]))
+        ingredients = itertools.product(*ingredients)
+        ingredients = [list(i) for i in ingredients]
+        attribute['name'] = name
+        attribute['category'] = category
+        attribute['time'] = time
+        attribute['products'] = products
+        attribute['ingredients'] = ingredients
+        return attribute
+
+    def get_single_resource_attr(self, resource, temperature_attr):
+        attribute = {}
+        name = 'resource/'+resource.name
+        category = 'mining/'+resource.category
+        time = resource.mining_time
+        products = self.get_products(resource.results, temperature_attr)
+        ingredients = [[(name, 1)]]
+        if resource.fluid_amount > 0:
+            ingredient_name = 'fluid/' + resource.required_fluid
+            if ingredient_name in temperature_attr:
+                numbers = range(len(temperature_attr[ingredient_name]))
+                ingredients.append([(ingredient_name+'@'+str(i), resource.fluid_amount) for i in numbers])
+            else:
+                ingredients.append([(ingredient_name, resource.fluid_amount)])
+        ingredients = itertools.product(*ingredients)
+        ingredients = [list(i) for i in ingredients]
+        attribute['name'] = name
+        attribute['category'] = category
+        attribute['time'] = time
+        attribute['products'] = products
+        attribute['ingredients'] = ingredients
+        return attribute
+
+    def get_recipe_attr(self):
+        temperature_attr = self.get_stage('temperature_attr')
         result = {}
         for recipe in self.recipes.values():
-            attribute = {}
-            name = 'recipe/'+recipe.name
-            category = 'crafting/'+recipe.category
-            time = recipe.energy_required
-            products = {}
-            for product in recipe.results:
-                product_name = product.type+'/'+product.name
-                if product_name in temperature_attr:
-                    number = -1
-                    for i, temps in enumerate(temperature_attr[product_name]):
-                        if product.temperature in temps:
-                            number = i
-                    assert number != -1
-                    product_name = product_name+'@'+str(number)
-                if product_name not in products:
-                    products[product_name] = 0
-                assert product.amount is not None, product_name
-                products[product_name] += product.amount
-            products = [(k, v) for k, v in products.items()]
-            products.sort(key=lambda s: order(s[0]))
-            ingredients = []
-            available = True
-            for ingredient in recipe.ingredients:
-                ingredient_name = ingredient.type+'/'+ingredient.name
-                if ingredient_name in temperature_attr:
-                    numbers = []
-                    for i, temps in enumerate(temperature_attr[ingredient_name]):
-                        if len(temps) == 0 or ingredient.minimum_temperature <= temps[0] <= ingredient.maximum_temperature:
-                            numbers.append(i)
-                    ingredients.append([(ingredient_name+'@'+str(i), ingredient.amount) for i in numbers])
-                    if len(numbers) == 0:
-                        available = False
-                elif not ingredient_name.startswith('fluid/') \
-                        or any(ingredient.minimum_temperature <= temp <= ingredient.maximum_temperature
-                               for temp in self.fluids[ingredient_name[6:]].available_temperatures):
-                    ingredients.append([(ingredient_name, ingredient.amount)])
-                else:
-                    available = False
-            if not available:
-                continue
-            ingredients.sort(key=lambda s: order(s[0][0]))
-            ingredients = itertools.product(*ingredients)
-            ingredients = [list(i) for i in ingredients]
-            attribute['name'] = name
-            attribute['category'] = category
-            attribute['time'] = time
-            attribute['products'] = products
-            attribute['ingredients'] = ingredients
-            result[name] = attribute
+            attribute = self.get_single_recipe_attr(recipe, temperature_attr)
+            if attribute is not None:
+                result[attribute['name']] = attribute
         for resource in self.resources.values():
-            attribute = {}
-            name = 'resource/'+resource.name
-            category = 'mining/'+resource.category
-            time = resource.mining_time
-            products = {}
-            for product in resource.results:
-                product_name = product.type + '/' + product.name
-                if product_name in temperature_attr:
-                    number = -1
-                    for i, temps in enumerate(temperature_attr[product_name]):
-                        if product.temperature in temps:
-                            number = i
-                    assert number != -1
-                    product_name = product_name + '@' + str(number)
-                if product_name not in products:
-                    products[product_name] = 0
-                assert product.amount is not None, product_name
-                products[product_name] += product.amount
-            products = [(k, v) for k, v in products.items()]
-            products.sort(key=lambda s: order(s[0]))
-            ingredients = [[(name, 1)]]
-            if resource.fluid_amount > 0:
-                ingredient_name = 'fluid/' + resource.required_fluid
-                if ingredient_name in temperature_attr:
-                    numbers = range(len(temperature_attr[ingredient_name]))
-                    ingredients.append([(ingredient_name+'@'+str(i), resource.fluid_amount) for i in numbers])
-                else:
-                    ingredients.append([(ingredient_name, resource.fluid_amount)])
-            ingredients = itertools.product(*ingredients)
-            ingredients = [list(i) for i in ingredients]
-            attribute['name'] = name
-            attribute['category'] = category
-            attribute['time'] = time
-            attribute['products'] = products
-            attribute['ingredients'] = ingredients
-            result[name] = attribute
+            attribute = self.get_single_resource_attr(resource, temperature_attr)
+            result[attribute['name']] = attribute
         return result
 
-    def generate(self):
+    def get_material_index(self):
+        producers = {}
+        consumers = {}
+
+        def add(index, material, recipe):
+            if material not in index:
+                index[material] = []
+            if not index[material] or index[material][-1] != recipe:
+                index[material].append(recipe)
+
+        for name, attribute in self.get_stage('recipe_attr').items():
+            for product, amount in attribute['products']:
+                add(producers, product, name)
+            for ingredients in attribute['ingredients']:
+                for ingredient, amount in ingredients:
+                    add(consumers, ingredient, name)
+        return {'producers': producers, 'consumers': consumers}
+
+    def get_recipe_matrix(self):
+        # CSR matrix of net amounts, one row per ingredient alternative of a recipe and one column per material;
+        # rows of the same recipe are adjacent and follow the order of its ingredient alternatives
+        recipe_attr = self.get_stage('recipe_attr')
+        rows = []
+        for name in sorted(recipe_attr):
+            attribute = recipe_attr[name]
+            for ingredients in attribute['ingredients']:
+                row = collections.defaultdict(int)
+                for product, amount in attribute['products']:
+                    row[product] += amount
+                for ingredient, amount in ingredients:
+                    row[ingredient] -= amount
+                rows.append((name, row))
+        materials = sorted(set(m for name, row in rows for m in row), key=self.get_material_order)
+        columns = {material: i for i, material in enumerate(materials)}
+        indptr = [0]
+        indices = []
+        values = []
+        for name, row in rows:
+            for column, material in sorted((columns[m], m) for m in row):
+                if row[material] != 0:
+                    indices.append(column)
+                    values.append(row[material])
+            indptr.append(len(indices))
+        return {'materials': materials, 'recipes': [name for name, row in rows],
+                'indptr': indptr, 'indices': indices, 'values': values}
+
+    def generate(self, extras=(), render=True):
+        extras = list(extras)
+        for name in extras:
+            assert self.wants(name), name + " was not selected when the extractor was created"
+        if self.sections is not None:
+            extras += [name for name in DataExtractor.optional_sections if name in self.sections and name not in extras]
         result = {}
-        self.resolve_fluid_temperature()
-        result['order_info'] = self.get_order_info()
-        result['free_fluids'] = self.get_free_fluids()
-        result['unlockable_recipes'] = self.get_unlockable_recipes()
-        group_icons, tech_icons, small_icons, icon_mapping = self.get_icons()
-        result['icon_mapping'] = icon_mapping
-        result['localised_names'] = self.get_localised_names()
-        result['machine_attr'] = self.get_machine_attr()
-        result['module_attr'] = self.get_module_attr()
-        result['temperature_attr'] = self.get_temperature_attr()
-        result['recipe_attr'] = self.get_recipe_attr()
+        group_icons = tech_icons = small_icons = None
+        if render and any(self.wants(sheet) for sheet in DataExtractor.icon_sheets):
+            group_icons, tech_icons, small_icons = self.get_stage('icons')[:3]
+        for name in DataExtractor.standard_sections:
+            if self.wants(name):
+                result[name] = self.get_stage(name)
+        if self.compact_limitations and self.wants('module_attr'):
+            result['limitation_sets'] = self.get_stage('limitation_sets')
+        for name in extras:
+            result[name] = self.get_stage(name)
         return group_icons, tech_icons, small_icons, result
 
     @staticmethod
-    def check_dump(n):
-        assert n is not None
-        if type(n) == dict:
-            for k, v in n.items():
-                assert type(k) == str
-                DataExtractor.check_dump(v)
-        elif type(n) == list:
-            for v in n:
-                DataExtractor.check_dump(v)
-        elif type(n) == tuple:
-            for v in n:
-                DataExtractor.check_dump(v)
-        else:
-            assert type(n) == bool or type(n) == str or type(n) == int or type(n) == float, type(n)
+    def check_dump(n, partial=False):
+        validate_info(n, partial)
 
-    def generate_and_dump(self, dir):
-        group_icons, tech_icons, small_icons, result = self.generate()
-        DataExtractor.check_dump(result)
+    def generate_and_dump(self, dir, extras=(), formats=('json',), store=None):
+        start = time.perf_counter()
+        group_icons, tech_icons, small_icons, result = self.generate(extras)
+        self.timings['generate'] = time.perf_counter() - start
+        start = time.perf_counter()
+        DataExtractor.check_dump(result, self.sections is not None)
         os.makedirs(dir, exist_ok=True)
-        with open(os.path.join(dir, 'info.json'), 'w', encoding='utf-8') as f:
-            json.dump(result, f, indent=2)
-        group_icons.save(os.path.join(dir, 'group.png'))
-        tech_icons.save(os.path.join(dir, 'tech.png'))
-        small_icons.save(os.path.join(dir, 'small.png'))
+        if 'json' in formats:
+            with open(os.path.join(dir, 'info.json'), 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=2)
+        if 'columnar' in formats:
+            with open(os.path.join(dir, 'info.bin'), 'wb') as f:
+                columnar.dump(result, f)
+        if 'dataraw' in formats:
+            with open(os.path.join(dir, 'data-raw.ndjson'), 'w', encoding='utf-8') as f:
+                self.lua_loader.export_dataraw(f)
+        sheets = {sheet: icons for sheet, icons in zip(DataExtractor.icon_sheets, (group_icons, tech_icons, small_icons))
+                  if icons is not None}
+        files = DataExtractor.get_sheet_files(sheets)
+        if 'store' in formats:
+            assert store is not None, "The store format needs a ContentStore"
+            icon_sheets = self.get_stage('icon_sheets')
+            icons = {}
+            for sheet in sheets:
+                icons.update(icon_sheets[sheet][0])
+            store.dump(dir, result, files, icons, self.icon_loader)
+        # a dump that only goes to the store has no standalone files
+        if set(formats) - {'store'}:
+            for file, image in files.items():
+                image.save(os.path.join(dir, file))
+        self.timings['dump'] = time.perf_counter() - start
+
+    @staticmethod
+    def generate_variants(game_dir, mods_dir, difficulty, settings_files, dir, processes=1, extras=(),
+                          checkpoint=None, mod_lists=None):
+        dirs = [os.path.join(dir, os.path.splitext(os.path.basename(f))[0]) for f in settings_files]
+        assert len(set(dirs)) == len(dirs), "Settings files must have distinct names"
+        if checkpoint is not None:
+            return DataExtractor.fork_variants(game_dir, mods_dir, difficulty, settings_files, dirs, checkpoint,
+                                               processes, extras, mod_lists)
+        assert mod_lists is None, "Variants with their own mod lists need a checkpoint"
+        context = _create_variant_context(game_dir, mods_dir)
+        if processes <= 1 or len(settings_files) <= 1:
+            for settings_file, variant_dir in zip(settings_files, dirs):
+                _generate_variant(game_dir, mods_dir, difficulty, settings_file, variant_dir, extras, context)
+            return dirs
+        # the first variant warms the icon cache that the forked workers inherit
+        _generate_variant(game_dir, mods_dir, difficulty, settings_files[0], dirs[0], extras, context)
+        if 'fork' in multiprocessing.get_all_start_methods():
+            mp_context = multiprocessing.get_context('fork')
+            worker_context = context
+        else:
+            # spawned workers build their own context instead of unpickling this one
+            mp_context = multiprocessing.get_context()
+            worker_context = None
+        with concurrent.futures.ProcessPoolExecutor(processes, mp_context=mp_context,
+                                                    initializer=_init_variant_worker,
+                                                    initargs=(game_dir, mods_dir, worker_context)) as executor:
+            futures = [executor.submit(_generate_variant, game_dir, mods_dir, difficulty, settings_file, variant_dir,
+                                       extras)
+                       for settings_file, variant_dir in zip(settings_files[1:], dirs[1:])]
+            for future in futures:
+                future.result()
+        return dirs
+
+    @staticmethod
+    def fork_variants(game_dir, mods_dir, difficulty, settings_files, dirs, checkpoint, processes=1, extras=(),
+                      mod_lists=None):
+        # lua runs up to the (stage, mod name) checkpoint once, then every variant continues in a forked
+        # copy of that state with its own settings and mod list
+        assert hasattr(os, 'fork'), "Checkpoints need os.fork"
+        mod_manager = ModManager(game_dir, mods_dir)
+        mod_settings = PropertyTree.load_mod_settings(os.path.join(mods_dir, 'mod-settings.dat'))
+        lua_loader = LuaLoader(mod_manager, mod_settings, checkpoint=checkpoint)
+        assert not lua_loader.complete, "Checkpoint " + str(checkpoint) + " is never reached"
+        pending = list(zip(settings_files, dirs, mod_lists or [None] * len(settings_files)))
+        running = {}
+        failed = []
+        while pending or running:
+            while pending and len(running) < max(processes, 1):
+                settings_file, variant_dir, mod_list = pending.pop(0)
+                sys.stdout.flush()
+                pid = os.fork()
+                if pid == 0:
+                    status = 1
+                    try:
+                        variant_manager = mod_manager
+                        if mod_list is not None:
+                            variant_manager = ModManager(game_dir, mods_dir, mod_list=mod_list,
+                                                         inventory=mod_manager.inventory)
+                        # zip files opened before the fork share their file offsets with the other workers
+                        variant_manager.reopen()
+                        variant_settings = PropertyTree.load_mod_settings(settings_file)
+                        lua_loader.resume(variant_settings, variant_manager if mod_list is not None else None)
+                        data_extractor = DataExtractor(game_dir, mods_dir, difficulty, mod_settings=variant_settings,
+                                                       mod_manager=variant_manager, lua_loader=lua_loader)
+                        data_extractor.generate_and_dump(variant_dir, extras)
+                        status = 0
+                    except BaseException:
+                        traceback.print_exc()
+                    finally:
+                        sys.stdout.flush()
+                        sys.stderr.flush()
+                        os._exit(status)
+                running[pid] = variant_dir
+            pid, status = os.waitpid(-1, 0)
+            variant_dir = running.pop(pid)
+            if status != 0:
+                failed.append(variant_dir)
+        assert not failed, "Variants failed: " + ', '.join(failed)
+        return dirs
 
 
 if __name__ == '__main__':
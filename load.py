@@ -1,9 +1,15 @@
 import os
 import io
+import functools
+import hashlib
+import importlib
 import json
+import marshal
 import zipfile
 import re
 import struct
+import sys
+import time
 import lupa
 
 
@@ -24,6 +30,12 @@ class Mod:
     def listdir(self, path):
         return NotImplementedError
 
+    def get_stamp(self, files):
+        return NotImplementedError
+
+    def reopen(self):
+        pass
+
     @staticmethod
     def get_mod(path):
         if os.path.isdir(path):
@@ -36,24 +48,68 @@ class Mod:
                     return ZipMod(path)
         return None
 
+    @functools.cached_property
+    def version(self):
+        return Mod.parse_version(self.info['version'])
+
+    @functools.cached_property
+    def dependencies(self):
+        return [Dependency.parse(d) for d in self.info.get('dependencies', [])]
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def parse_version(version):
+        version = tuple(map(int, version.split('.')))
+        return (version + (0, 0, 0))[:3]
+
     @staticmethod
     def version_compare(a, b):
-        a = list(map(int, a.split('.')))
-        b = list(map(int, b.split('.')))
-        while len(a) < 3:
-            a.append(0)
-        while len(b) < 3:
-            b.append(0)
+        a = Mod.parse_version(a)
+        b = Mod.parse_version(b)
         for i in range(3):
             if a[i] != b[i]:
                 return a[i] - b[i]
         return 0
 
 
+class Dependency:
+    pattern = re.compile('^(?:(\\?|\\(\\?\\)|!) *)?(.+?)(?: *([<>=]=?) *([0-9.]+))?$')
+    operators = {
+        '<=': lambda a, b: a <= b,
+        '>=': lambda a, b: a >= b,
+        '<': lambda a, b: a < b,
+        '>': lambda a, b: a > b,
+        '=': lambda a, b: a == b,
+        '==': lambda a, b: a == b,
+    }
+
+    def __init__(self, text, type_, name, sense, bound):
+        self.text = text
+        self.incompatible = '!' in type_
+        self.optional = '?' in type_
+        self.name = name
+        self.compare = None
+        if sense is not None and bound is not None:
+            self.compare = Dependency.operators[sense]
+            self.bound = Mod.parse_version(bound)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def parse(text):
+        match = Dependency.pattern.match(text)
+        return Dependency(text, match.group(1) or '', match.group(2), match.group(3), match.group(4))
+
+    def matches(self, mod):
+        return mod is not None and (self.compare is None or self.compare(mod.version, self.bound))
+
+
 class DirMod(Mod):
-    def __init__(self, path):
+    def __init__(self, path, info=None):
         self.path = path
-        self._load_info()
+        if info is None:
+            self._load_info()
+        else:
+            self.info = info
 
     def get_file(self, file):
         return open(os.path.join(self.path, *file.split('/')), encoding='utf-8-sig')
@@ -68,15 +124,29 @@ class DirMod(Mod):
         files = os.listdir(os.path.join(self.path, *path.split('/')))
         return [path+'/'+f for f in files]
 
+    def get_stamp(self, files):
+        stamp = []
+        for file in files:
+            stat = os.stat(os.path.join(self.path, *file.split('/')))
+            stamp.append((file, stat.st_size, stat.st_mtime_ns))
+        return stamp
+
 
 class ZipMod(Mod):
-    def __init__(self, path):
+    def __init__(self, path, info=None, prefix=None):
         assert path.endswith('.zip')
+        self.archive = path
         self.zipfile = zipfile.ZipFile(path)
-        self.path = os.path.basename(path)[:-4] + '/'
-        if self.path+"info.json" not in self.zipfile.namelist():
-            self.path = "_".join(os.path.basename(path).split("_")[:-1]) + "/"
-        self._load_info()
+        if prefix is not None:
+            self.path = prefix
+        else:
+            self.path = os.path.basename(path)[:-4] + '/'
+            if self.path+"info.json" not in self.zipfile.namelist():
+                self.path = "_".join(os.path.basename(path).split("_")[:-1]) + "/"
+        if info is None:
+            self._load_info()
+        else:
+            self.info = info
 
     def get_file(self, file):
         file = re.sub('/+', '/', file)
@@ -96,98 +166,195 @@ class ZipMod(Mod):
     def listdir(self, path):
         return [f[len(self.path):] for f in self.zipfile.namelist() if f.startswith(self.path+path)]
 
+    def get_stamp(self, files):
+        # the central directory already has a checksum of every file, nothing needs to be decompressed
+        stamp = []
+        for file in files:
+            info = self.zipfile.getinfo(self.path+re.sub('/+', '/', file))
+            stamp.append((file, info.file_size, info.CRC))
+        return stamp
+
+    def reopen(self):
+        # a forked process must not share the file offset of the parent's handle
+        self.zipfile = zipfile.ZipFile(self.archive)
+
     def __del__(self):
         self.zipfile.close()
 
 
+class ModRegistry:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def get_stamp(path):
+        if os.path.isdir(path):
+            path = os.path.join(path, 'info.json')
+            if not os.path.exists(path):
+                return None
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def get_mod(self, path):
+        key = os.path.abspath(path)
+        stamp = ModRegistry.get_stamp(path)
+        entry = self.entries.get(key)
+        if entry is not None and entry['stamp'] == stamp:
+            if entry['info'] is None:
+                return None
+            if entry['prefix'] is None:
+                return DirMod(path, entry['info'])
+            return ZipMod(path, entry['info'], entry['prefix'])
+        mod = Mod.get_mod(path) if stamp is not None else None
+        self.entries[key] = {
+            'stamp': stamp,
+            'info': mod.info if mod is not None else None,
+            'prefix': mod.path if isinstance(mod, ZipMod) else None,
+        }
+        self.changed = True
+        return mod
+
+    def save(self):
+        if not self.changed:
+            return
+        temp = self.path + '.' + str(os.getpid())
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(temp, self.path)
+        self.changed = False
+
+
 class ModManager:
-    def __init__(self, game_dir, mods_dir):
+    def __init__(self, game_dir, mods_dir, registry=None, mod_list=None, inventory=None):
         self.game_dir = game_dir
         self.mods_dir = mods_dir
-        self.mods = self.get_all_mods()
+        self.registry = registry
+        if inventory is None:
+            get_mod = Mod.get_mod if registry is None else registry.get_mod
+            inventory = ModManager.scan_mods(game_dir, mods_dir, get_mod)
+            if registry is not None:
+                registry.save()
+        self.inventory = inventory
+        if mod_list is None:
+            with open(os.path.join(self.mods_dir, 'mod-list.json')) as f:
+                mod_list = json.load(f)
+        self.mods = self.get_all_mods(mod_list)
         self.mod_order = ModManager.resolve_dependency(self.mods)
 
-    def get_all_mods(self):
+    def reopen(self):
+        for mod in self.mods.values():
+            mod.reopen()
+
+    @staticmethod
+    def scan_mods(game_dir, mods_dir, get_mod=Mod.get_mod):
         mods = {}
-        for file in os.listdir(os.path.join(self.game_dir, 'data')):
-            mod = Mod.get_mod(os.path.join(self.game_dir, 'data', file))
+        for file in os.listdir(os.path.join(game_dir, 'data')):
+            mod = get_mod(os.path.join(game_dir, 'data', file))
             if mod is not None:
                 name = mod.info['name']
                 version = '0.0.0' if name == 'core' else mod.info['version']
                 if name not in mods:
                     mods[name] = {}
                 mods[name][version] = mod
-        for file in os.listdir(self.mods_dir):
-            mod = Mod.get_mod(os.path.join(self.mods_dir, file))
+        for file in os.listdir(mods_dir):
+            mod = get_mod(os.path.join(mods_dir, file))
             if mod is not None:
                 name = mod.info['name']
                 version = mod.info['version']
                 if name not in mods:
                     mods[name] = {}
                 mods[name][version] = mod
-
-        with open(os.path.join(self.mods_dir, 'mod-list.json')) as f:
-            mod_list = json.load(f)
-        enabled_mods = {'core': mods['core']['0.0.0']}
-        for mod in mod_list['mods']:
-            if mod['enabled']:
-                assert mod['name'] in mods, "Cannot locate mod "+mod['name']
-                mod_versions = mods[mod['name']]
-                if 'version' in mod:
-                    assert mod['version'] in mod_versions,\
-                        "Cannot locate mod "+mod['name']+" with version "+mod['version']
-                    enabled_mods[mod['name']] = mod_versions[mod['version']]
-                else:
-                    latest_version = "0.0.0"
-                    for version in mod_versions:
-                        if Mod.version_compare(latest_version, version) < 0:
-                            latest_version = version
-                    enabled_mods[mod['name']] = mod_versions[latest_version]
-
+        return mods
+
+    def select_mods(self, enabled, versions=None):
+        versions = versions or {}
+        mods = {'core': self.inventory['core']['0.0.0']}
+        errors = []
+        for name in enabled:
+            if name == 'core':
+                continue
+            if name not in self.inventory:
+                errors.append("Cannot locate mod "+name)
+                continue
+            mod_versions = self.inventory[name]
+            if versions.get(name) is not None:
+                if versions[name] not in mod_versions:
+                    errors.append("Cannot locate mod "+name+" with version "+versions[name])
+                    continue
+                mods[name] = mod_versions[versions[name]]
+            else:
+                mods[name] = mod_versions[max(mod_versions, key=Mod.parse_version)]
+        return mods, errors
+
+    def get_all_mods(self, mod_list):
+        enabled = [mod['name'] for mod in mod_list['mods'] if mod['enabled']]
+        versions = {mod['name']: mod['version'] for mod in mod_list['mods'] if mod['enabled'] and 'version' in mod}
+        enabled_mods, errors = self.select_mods(enabled, versions)
+        assert not errors, errors[0]
         return enabled_mods
 
+    def evaluate(self, enabled, versions=None):
+        # the mods that were found are still checked, so that every problem is reported at once
+        mods, select_errors = self.select_mods(enabled, versions)
+        mod_order, dependency_errors = ModManager.check_dependency(mods)
+        errors = select_errors + dependency_errors
+        if errors:
+            return None, errors
+        return mod_order, []
+
+    def with_mods(self, enabled, versions=None):
+        versions = versions or {}
+        mod_list = {'mods': []}
+        for name in enabled:
+            mod = {'name': name, 'enabled': True}
+            if versions.get(name) is not None:
+                mod['version'] = versions[name]
+            mod_list['mods'].append(mod)
+        return ModManager(self.game_dir, self.mods_dir, self.registry, mod_list, self.inventory)
+
     @staticmethod
-    def resolve_dependency(mods):
-        tier = {name: -1 for name in mods}
-
-        def resolve(mod_name):
-            tier[mod_name] = -2
-            highest_dep = -1
-            for dep in mods[mod_name].info['dependencies']:
-                match = re.match('^(?:(\\?|\\(\\?\\)|!) *)?(.+?)(?: *([<>=]=?) *([0-9.]+))?$', dep)
-                type_ = match.group(1)
-                name = match.group(2)
-                sense = match.group(3)
-                bound = match.group(4)
-                present = None
-                if name in mods:
-                    present = mods[name]
-                    if sense is not None and bound is not None:
-                        if '<' in sense and '=' in sense:
-                            if Mod.version_compare(present.info['version'], bound) > 0:
-                                present = None
-                        elif '>' in sense and '=' in sense:
-                            if Mod.version_compare(present.info['version'], bound) < 0:
-                                present = None
-                        elif '<' in sense:
-                            if Mod.version_compare(present.info['version'], bound) >= 0:
-                                present = None
-                        elif '>' in sense:
-                            if Mod.version_compare(present.info['version'], bound) <= 0:
-                                present = None
-                        else:
-                            if Mod.version_compare(present.info['version'], bound) != 0:
-                                present = None
-                if type_ is None:
-                    type_ = ''
-                assert '!' not in type_ or present is None, "Dependency not satisfied "+dep
-                assert '!' in type_ or '?' in type_ or present is not None, "Dependency not satisfied "+dep
-                if present is not None:
-                    assert tier[name] != -2, "Circular dependency"
-                    if tier[name] == -1:
-                        resolve(name)
-                    highest_dep = max(highest_dep, tier[name])
-            tier[mod_name] = highest_dep + 1
+    def check_dependency(mods):
+        errors = []
+        edges = {}
+        for mod_name, mod in mods.items():
+            edges[mod_name] = []
+            for dep in mod.dependencies:
+                present = dep.matches(mods.get(dep.name))
+                if dep.incompatible:
+                    if present:
+                        errors.append(mod_name + ": incompatible mod is enabled: " + dep.text)
+                elif present:
+                    edges[mod_name].append(dep.name)
+                elif not dep.optional:
+                    errors.append(mod_name + ": dependency not satisfied: " + dep.text)
+
+        # longest dependency chain of every mod, computed without recursion
+        tier = {}
+        for root in mods:
+            if root in tier:
+                continue
+            path = [root]
+            stack = [iter(edges[root])]
+            on_path = {root}
+            while stack:
+                dep = next(stack[-1], None)
+                if dep is None:
+                    mod_name = path.pop()
+                    on_path.remove(mod_name)
+                    stack.pop()
+                    tier[mod_name] = max((tier[d] for d in edges[mod_name] if d in tier), default=-1) + 1
+                elif dep in on_path:
+                    cycle = path[path.index(dep):] + [dep]
+                    errors.append("Circular dependency: " + " -> ".join(cycle))
+                elif dep not in tier:
+                    path.append(dep)
+                    on_path.add(dep)
+                    stack.append(iter(edges[dep]))
 
         def natural_sort(list, key=lambda s: s):
             def get_alphanum_key_func(key):
@@ -196,12 +363,15 @@ class ModManager:
             sort_key = get_alphanum_key_func(key)
             list.sort(key=sort_key)
 
-        for name in mods:
-            if tier[name] == -1:
-                resolve(name)
         tier['core'] = -1
         sorted_mods = list(mods.keys())
         natural_sort(sorted_mods, key=lambda n: str(tier[n]+1)+n.lstrip())
+        return sorted_mods, errors
+
+    @staticmethod
+    def resolve_dependency(mods):
+        sorted_mods, errors = ModManager.check_dependency(mods)
+        assert not errors, "Cannot resolve mod dependencies:\n" + "\n".join(errors)
         return sorted_mods
 
 
@@ -277,13 +447,115 @@ class PropertyTree:
             return PropertyTree.load_property_tree(f)
 
 
+def lua_type(value):
+    # lupa.lua_type only recognizes objects of its own runtime module, not those of the luajit one
+    module = sys.modules.get(type(value).__module__)
+    if module is None or not hasattr(module, 'lua_type'):
+        return None
+    return module.lua_type(value)
+
+
 class LuaLoader:
-    def __init__(self, mod_manager, mod_settings):
+    compilers = {}
+    stages = ('data', 'data-updates', 'data-final-fixes')
+    engines = ('lua', 'luajit')
+
+    # Factorio runs lua 5.2, these fill in what mods use from it when the runtime is lua 5.1 or luajit
+    compatibility_source = '''
+        if table.unpack == nil then
+          table.unpack = unpack
+        end
+        if table.pack == nil then
+          function table.pack(...)
+            return {n = select('#', ...), ...}
+          end
+        end
+        if not pcall(load, 'return') then
+          local load51 = load
+          function load(chunk, name, mode, env)
+            local f, err
+            if type(chunk) == 'string' then
+              f, err = loadstring(chunk, name)
+            else
+              f, err = load51(chunk, name)
+            end
+            if f and env then
+              setfenv(f, env)
+            end
+            return f, err
+          end
+        end
+        if bit32 == nil and bit ~= nil then
+          local bit = bit
+          local function u(x)
+            return x % 4294967296
+          end
+          local function fold(f, empty, ...)
+            if select('#', ...) == 0 then
+              return empty
+            end
+            return u(f(...))
+          end
+          local function shift(x, n, left)
+            if n < 0 then
+              n, left = -n, not left
+            end
+            if n >= 32 then
+              return 0
+            end
+            return u(left and bit.lshift(x, n) or bit.rshift(x, n))
+          end
+          bit32 = {}
+          function bit32.band(...) return fold(bit.band, 4294967295, ...) end
+          function bit32.bor(...) return fold(bit.bor, 0, ...) end
+          function bit32.bxor(...) return fold(bit.bxor, 0, ...) end
+          function bit32.btest(...) return bit32.band(...) ~= 0 end
+          function bit32.bnot(x) return u(bit.bnot(x)) end
+          function bit32.lshift(x, n) return shift(x, n, true) end
+          function bit32.rshift(x, n) return shift(x, n, false) end
+          function bit32.arshift(x, n)
+            if n <= 0 then
+              return shift(x, -n, true)
+            end
+            if n >= 32 then
+              return u(x) >= 2147483648 and 4294967295 or 0
+            end
+            return u(bit.arshift(x, n))
+          end
+          function bit32.lrotate(x, n) return u(bit.rol(x, n % 32)) end
+          function bit32.rrotate(x, n) return u(bit.ror(x, n % 32)) end
+          function bit32.extract(x, field, width)
+            width = width or 1
+            return u(bit.band(bit.rshift(x, field), 2 ^ width - 1))
+          end
+          function bit32.replace(x, v, field, width)
+            width = width or 1
+            local mask = bit.lshift(2 ^ width - 1, field)
+            return u(bit.bor(bit.band(x, bit.bnot(mask)), bit.band(bit.lshift(v, field), mask)))
+          end
+        end'''
+
+    def __init__(self, mod_manager, mod_settings, chunk_cache=None, time_budget=None, memory_budget=None,
+                 track_changes=False, progress=None, checkpoint=None, engine='lua'):
         self.package = None
         self.current_path = None
         self.mod_manager = mod_manager
         self.mod_settings = mod_settings
-        self.lua = lupa.LuaRuntime()
+        self.chunk_cache = chunk_cache
+        # budgets are either a single limit for every mod stage or a dict from stage name to limit,
+        # in seconds of cpu time and bytes of lua heap
+        self.time_budget = time_budget
+        self.memory_budget = memory_budget
+        self.report = []
+        self.loaded = []
+        self.finished_stages = []
+        self.track_changes = track_changes
+        self.progress = progress
+        self.engine = engine
+        self.lupa = LuaLoader.get_engine(engine)
+        self.lua = LuaLoader.create_runtime(memory_budget, self.lupa)
+        self.lua.execute(LuaLoader.compatibility_source)
+        self.lua_load = self.lua.eval('function(s, name) return assert(load(s, name)) end')
         self.lua.execute('function math.pow(x,y) return x^y end')
         serpent = self.lua.require('serpent')
         self.lua.globals().serpent = serpent
@@ -308,11 +580,192 @@ class LuaLoader:
         self.push_mods()
         self.push_mod_settings()
 
-        with self.mod_manager.mods['core'].get_file('lualib/dataloader.lua') as f:
-            file = f.read()
-            self.lua.eval('function(s) return load(s)() end')(file)
+        self.load_chunk('core', 'lualib/dataloader.lua')()
+
+        self.fingerprint = None
+        if track_changes:
+            self.fingerprint = self.lua.execute(LuaLoader.fingerprint_source)
 
-        self.load_mods()
+        self.complete = self.load_mods(checkpoint)
+
+    @staticmethod
+    def get_engine(engine):
+        assert engine in LuaLoader.engines, "Unknown lua engine " + str(engine)
+        if engine == 'lua':
+            return lupa
+        # lupa 2 ships a module per lua version, older versions only have the runtime they were built with
+        for name in ('lupa.luajit21', 'lupa.luajit20'):
+            try:
+                return importlib.import_module(name)
+            except ImportError:
+                pass
+        assert lupa.LuaRuntime().eval('jit ~= nil'), "lupa does not provide a luajit runtime"
+        return lupa
+
+    @staticmethod
+    def compare_engines(mod_manager, mod_settings, engines=engines, **options):
+        # loads the mods with every engine, returns the load times and the prototypes that differ
+        seconds = {}
+        dumps = {}
+        for engine in engines:
+            start = time.perf_counter()
+            loader = LuaLoader(mod_manager, mod_settings, engine=engine, **options)
+            seconds[engine] = time.perf_counter() - start
+            dump = loader.lua.eval('''function()
+                local result = {}
+                for type_name, prototypes in pairs(data.raw) do
+                  for name, prototype in pairs(prototypes) do
+                    result[type_name .. '/' .. tostring(name)] =
+                      serpent.line(prototype, {comment = false, nocode = true, sortkeys = true})
+                  end
+                end
+                return result
+              end''')()
+            dumps[engine] = dict(dump.items())
+        names = set()
+        for dump in dumps.values():
+            names.update(dump)
+        differences = sorted(name for name in names if len(set(dump.get(name) for dump in dumps.values())) > 1)
+        return {'seconds': seconds, 'differences': differences}
+
+    @staticmethod
+    def create_runtime(memory_budget, engine=lupa):
+        limits = memory_budget.values() if isinstance(memory_budget, dict) else [memory_budget]
+        limits = [limit for limit in limits if limit is not None]
+        if limits:
+            # newer lupa versions can also refuse allocations past the largest budget
+            try:
+                return engine.LuaRuntime(max_memory=max(limits))
+            except TypeError:
+                pass
+        return engine.LuaRuntime()
+
+    @staticmethod
+    def get_budget(budget, stage):
+        if isinstance(budget, dict):
+            return budget.get(stage)
+        return budget
+
+    def set_budget(self, stage):
+        time_limit = LuaLoader.get_budget(self.time_budget, stage)
+        memory_limit = LuaLoader.get_budget(self.memory_budget, stage)
+        if time_limit is None and memory_limit is None:
+            return
+        self.lua.eval('function(time_limit, memory_limit)\n'
+                      '  local deadline = time_limit and os.clock() + time_limit\n'
+                      '  local memory_limit_kb = memory_limit and memory_limit / 1024\n'
+                      '  debug.sethook(function()\n'
+                      '    if deadline and os.clock() > deadline then\n'
+                      '      error("time budget exceeded", 2)\n'
+                      '    end\n'
+                      '    if memory_limit_kb and collectgarbage("count") > memory_limit_kb then\n'
+                      '      error("memory budget exceeded", 2)\n'
+                      '    end\n'
+                      '  end, "", 10000)\n'
+                      'end')(time_limit, memory_limit)
+
+    # Every prototype is reduced to an order independent structural hash modulo a prime below 2^26, so that
+    # all arithmetic stays exact in doubles. Scalars are numbered the first time they are seen and keep their
+    # number for the whole load, so only the fingerprints of the previous snapshot are kept, never the data.
+    fingerprint_source = '''
+        local P = 67108859
+        local ids, count = {}, 0
+        local function mix(a, b)
+          local x = (a * 40503 + b + 40499) % P
+          return x * x % P
+        end
+        local function scalar(v)
+          local t = type(v)
+          local by_type = ids[t]
+          if not by_type then
+            by_type = {}
+            ids[t] = by_type
+          end
+          if v ~= v then
+            v = 'nan'
+          end
+          local id = by_type[v]
+          if not id then
+            count = count + 1
+            id = mix(count, 1)
+            by_type[v] = id
+          end
+          return id
+        end
+        local function hash(v, memo)
+          if type(v) ~= 'table' then
+            return scalar(v)
+          end
+          local h = memo[v]
+          if h then
+            return h
+          end
+          memo[v] = 0
+          h = 0
+          for k, x in pairs(v) do
+            h = (h + mix(hash(k, memo), hash(x, memo))) % P
+          end
+          h = mix(h, 2)
+          memo[v] = h
+          return h
+        end
+        local previous = {}
+        return function()
+          local current, added, modified, removed, memo = {}, {}, {}, {}, {}
+          for type_name, prototypes in pairs(data.raw) do
+            local hashes = {}
+            local old = previous[type_name] or {}
+            for name, prototype in pairs(prototypes) do
+              local h = hash(prototype, memo)
+              hashes[name] = h
+              if old[name] == nil then
+                added[#added + 1] = type_name .. '/' .. tostring(name)
+              elseif old[name] ~= h then
+                modified[#modified + 1] = type_name .. '/' .. tostring(name)
+              end
+            end
+            current[type_name] = hashes
+          end
+          for type_name, hashes in pairs(previous) do
+            local new = current[type_name] or {}
+            for name in pairs(hashes) do
+              if new[name] == nil then
+                removed[#removed + 1] = type_name .. '/' .. tostring(name)
+              end
+            end
+          end
+          previous = current
+          return added, modified, removed
+        end'''
+
+    def get_changes(self):
+        return [sorted(names.values()) for names in self.fingerprint()]
+
+    def get_memory(self):
+        return int(self.lua.eval('(collectgarbage("count"))') * 1024)
+
+    @staticmethod
+    def compile(source, chunk_name, engine='lua'):
+        # string.dump output is not valid utf-8, so it is produced by a runtime without string decoding,
+        # and bytecode only loads in the engine that produced it
+        if engine not in LuaLoader.compilers:
+            runtime = LuaLoader.get_engine(engine).LuaRuntime(encoding=None)
+            runtime.execute(LuaLoader.compatibility_source)
+            LuaLoader.compilers[engine] = runtime.eval(
+                'function(s, name) return string.dump(assert(load(s, name))) end')
+        return LuaLoader.compilers[engine](source.encode('utf-8'), chunk_name.encode('utf-8'))
+
+    def load_chunk(self, mod_name, file):
+        mod = self.mod_manager.mods[mod_name]
+        chunk_name = '@__' + mod_name + '__/' + file
+        if self.chunk_cache is None:
+            with mod.get_file(file) as f:
+                return self.lua_load(f.read(), chunk_name)
+        key = mod_name, mod.info['version'], file, self.engine
+        if key not in self.chunk_cache:
+            with mod.get_file(file) as f:
+                self.chunk_cache[key] = LuaLoader.compile(f.read(), chunk_name, self.engine)
+        return self.lua_load(self.chunk_cache[key], chunk_name)
 
     def require(self, module):
         if self.lua.globals().package.loaded[module] is not None:
@@ -340,10 +793,7 @@ class LuaLoader:
         module = '/'.join(module.split('.')) + '.lua'
 
         assert(self.mod_manager.mods[self.package].exists(module)), (self.package, module)
-        with self.mod_manager.mods[self.package].get_file(module) as f:
-            file = f.read()
-
-        eval_result = self.lua.eval('function(fname, s) return load("--" .. fname .. "\\n" ..  s)() end')(module, file)
+        eval_result = self.load_chunk(self.package, module)()
         if eval_result is None:
             eval_result = True
         self.lua.globals().package.loaded[origin_name] = eval_result
@@ -362,57 +812,296 @@ class LuaLoader:
     def push_mod_settings(self):
         self.lua.globals().settings = self.lua.table_from(self.mod_settings)
 
-    def load_mods(self):
-        for stage in 'data', 'data-updates', 'data-final-fixes':
+    def get_steps(self):
+        steps = []
+        for stage in LuaLoader.stages:
             for mod_name in self.mod_manager.mod_order:
                 mod = self.mod_manager.mods[mod_name]
                 if mod.exists(stage + '.lua'):
-                    version = '0.0.0' if mod_name == 'core' else mod.info['version']
-                    print('Loading mod '+mod_name+' '+version+' ('+stage+'.lua)')
-                    self.package = mod_name
-                    self.current_path = ''
-                    with mod.get_file(stage + '.lua') as f:
-                        file = f.read()
-                        self.lua.eval('function(s) return load(s)() end')(file)
-                    self.lua.execute('package.loaded = {}')
+                    steps.append((stage, mod_name, '0.0.0' if mod_name == 'core' else mod.info['version']))
+        return steps
+
+    def load_mods(self, checkpoint=None):
+        # stops after the (stage, mod name) checkpoint and returns False, calling it again continues from there
+        steps = self.get_steps()
+        assert steps[:len(self.loaded)] == self.loaded, "The mods loaded before the checkpoint are not the same"
+        for stage in LuaLoader.stages:
+            if stage in self.finished_stages:
+                continue
+            for step in steps[len(self.loaded):]:
+                if step[0] != stage:
+                    break
+                self.load_mod(*step)
+                self.loaded.append(step)
+                if checkpoint is not None and step[:2] == tuple(checkpoint):
+                    return False
+            self.lua.execute('collectgarbage()')
+            self.report.append({'stage': stage, 'memory': self.get_memory()})
+            self.finished_stages.append(stage)
+        return True
+
+    def load_mod(self, stage, mod_name, version):
+        print('Loading mod '+mod_name+' '+version+' ('+stage+'.lua)')
+        if self.progress is not None:
+            self.progress({'event': 'mod', 'mod': mod_name, 'version': version, 'stage': stage})
+        self.package = mod_name
+        self.current_path = ''
+        entry = {'mod': mod_name, 'version': version, 'stage': stage, 'memory_before': self.get_memory()}
+        self.report.append(entry)
+        start = time.perf_counter()
+        self.set_budget(stage)
+        try:
+            self.load_chunk(mod_name, stage + '.lua')()
+        except MemoryError as e:
+            entry['error'] = 'memory budget exceeded'
+            raise AssertionError('Mod '+mod_name+' '+version+' ('+stage+'.lua): memory budget exceeded') from e
+        except self.lupa.LuaError as e:
+            entry['error'] = str(e)
+            for budget in ('time budget exceeded', 'memory budget exceeded', 'not enough memory'):
+                if budget in str(e):
+                    raise AssertionError('Mod '+mod_name+' '+version+' ('+stage+'.lua): '+budget) from e
+            raise
+        finally:
+            self.lua.execute('debug.sethook()')
+            entry['seconds'] = time.perf_counter() - start
+            entry['memory_after'] = self.get_memory()
+        if self.fingerprint is not None:
+            entry['added'], entry['modified'], entry['removed'] = self.get_changes()
+        self.lua.execute('package.loaded = {}')
+
+    def resume(self, mod_settings=None, mod_manager=None):
+        # the mods loaded before the checkpoint only saw the settings and mods the loader was created with
+        if mod_manager is not None:
+            self.mod_manager = mod_manager
+            self.push_mods()
+        if mod_settings is not None:
+            self.mod_settings = mod_settings
+            self.push_mod_settings()
+        self.complete = self.load_mods()
 
     def get_dataraw(self):
         return self.lua.globals().data.raw
 
+    # Encodes a single prototype as one line of json. Tables whose keys are exactly 1..n become arrays, other
+    # tables objects with sorted keys, where keys that are not strings are written as strings. A table in which
+    # two keys would then be written the same, like [1] and ["1"], is written as {"$keys": [[key, value], ...]}
+    # instead. A table that contains itself is written as {"$cycle": path}, functions as
+    # {"$function": source:line} and other values that json has no type for as {"$type": type}.
+    json_source = r'''
+        local escapes = {['"'] = '\\"', ['\\'] = '\\\\', ['\n'] = '\\n', ['\r'] = '\\r', ['\t'] = '\\t'}
+        local function escape(c)
+          return escapes[c] or string.format('\\u%04x', c:byte())
+        end
+        local function quote(s)
+          return '"' .. s:gsub('[%c"\\]', escape) .. '"'
+        end
+        local function number(v)
+          if v ~= v or v == math.huge or v == -math.huge then
+            return 'null'
+          end
+          if v == math.floor(v) and math.abs(v) < 2^53 then
+            return string.format('%d', v)
+          end
+          for digits = 14, 16 do
+            local s = string.format('%.' .. digits .. 'g', v)
+            if tonumber(s) == v then
+              return s
+            end
+          end
+          return string.format('%.17g', v)
+        end
+        local function key_string(k)
+          return type(k) == 'string' and k or tostring(k)
+        end
+        local function encode(v, out, path, visiting)
+          local t = type(v)
+          if t == 'string' then
+            out[#out + 1] = quote(v)
+          elseif t == 'number' then
+            out[#out + 1] = number(v)
+          elseif t == 'boolean' then
+            out[#out + 1] = tostring(v)
+          elseif t == 'function' then
+            local info = debug.getinfo(v, 'S')
+            out[#out + 1] = '{"$function":' .. quote(info.short_src .. ':' .. info.linedefined) .. '}'
+          elseif t ~= 'table' then
+            out[#out + 1] = '{"$type":"' .. t .. '"}'
+          elseif visiting[v] then
+            out[#out + 1] = '{"$cycle":' .. quote(visiting[v]) .. '}'
+          else
+            visiting[v] = path
+            local n = 0
+            for _ in pairs(v) do
+              n = n + 1
+            end
+            local array = true
+            for i = 1, n do
+              if v[i] == nil then
+                array = false
+                break
+              end
+            end
+            if array and n > 0 then
+              out[#out + 1] = '['
+              for i = 1, n do
+                if i > 1 then
+                  out[#out + 1] = ','
+                end
+                encode(v[i], out, path .. '.' .. i, visiting)
+              end
+              out[#out + 1] = ']'
+            else
+              local keys = {}
+              local by_string = {}
+              local collision = false
+              for k, x in pairs(v) do
+                k = key_string(k)
+                if by_string[k] == nil then
+                  keys[#keys + 1] = k
+                else
+                  collision = true
+                end
+                by_string[k] = x
+              end
+              if collision then
+                local entries = {}
+                for k, x in pairs(v) do
+                  entries[#entries + 1] = {k, x}
+                end
+                table.sort(entries, function(a, b)
+                  if type(a[1]) ~= type(b[1]) then
+                    return type(a[1]) < type(b[1])
+                  end
+                  return key_string(a[1]) < key_string(b[1])
+                end)
+                out[#out + 1] = '{"$keys":['
+                for i, entry in ipairs(entries) do
+                  if i > 1 then
+                    out[#out + 1] = ','
+                  end
+                  out[#out + 1] = '['
+                  encode(entry[1], out, path, visiting)
+                  out[#out + 1] = ','
+                  encode(entry[2], out, path .. '.' .. key_string(entry[1]), visiting)
+                  out[#out + 1] = ']'
+                end
+                out[#out + 1] = ']}'
+                visiting[v] = nil
+                return
+              end
+              table.sort(keys)
+              out[#out + 1] = '{'
+              for i, k in ipairs(keys) do
+                if i > 1 then
+                  out[#out + 1] = ','
+                end
+                encode(k, out, path, visiting)
+                out[#out + 1] = ':'
+                encode(by_string[k], out, path .. '.' .. k, visiting)
+              end
+              out[#out + 1] = '}'
+            end
+            visiting[v] = nil
+          end
+        end
+        return function(v, path)
+          local out = {}
+          encode(v, out, path, {})
+          return table.concat(out)
+        end'''
+
+    def export_dataraw(self, fd, types=None):
+        # writes data.raw as newline delimited json, one prototype per line in type and name order,
+        # only the prototype being written is ever encoded
+        encode = self.lua.execute(LuaLoader.json_source)
+        dataraw = self.get_dataraw()
+        count = 0
+        for type_name in sorted(types or dataraw.keys()):
+            prototypes = dataraw[type_name]
+            if prototypes is None:
+                continue
+            for name in sorted(prototypes.keys(), key=str):
+                fd.write(encode(prototypes[name], type_name + '.' + str(name)) + '\n')
+                count += 1
+        return count
+
 
 class LocaleProvider:
-    def __init__(self, current, default, mod_manager):
+    def __init__(self, current, default, mod_manager, cache=None, cache_dir=None):
         self.current_locale = current
         self.default_locale = default
         self.mod_manager = mod_manager
+        self.cache = cache
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
         self.current_values = self.load_locale(current)
         self.default_values = self.load_locale(default)
 
     def load_locale(self, locale):
+        # earlier mods take precedence, so they are merged last
+        values = {}
+        for mod_name in reversed(self.mod_manager.mod_order):
+            values.update(self.load_mod_locale(mod_name, locale))
+        return values
+
+    def load_mod_locale(self, mod_name, locale):
+        mod = self.mod_manager.mods[mod_name]
+        key = mod_name, mod.info['version'], locale
+        if self.cache is not None and key in self.cache:
+            return self.cache[key]
+        if self.cache_dir is None:
+            values = LocaleProvider.parse_mod_locale(mod, locale)
+        else:
+            values = self.load_compiled_locale(mod_name, mod, locale)
+        if self.cache is not None:
+            self.cache[key] = values
+        return values
+
+    def load_compiled_locale(self, mod_name, mod, locale):
+        files = LocaleProvider.get_locale_files(mod, locale)
+        stamp = repr((mod_name, mod.info['version'], locale, mod.get_stamp(files), marshal.version))
+        file = os.path.join(self.cache_dir, mod_name + '-' + hashlib.sha1(stamp.encode('utf-8')).hexdigest() + '.locale')
+        if os.path.exists(file):
+            with open(file, 'rb') as f:
+                return marshal.load(f)
+        values = LocaleProvider.parse_mod_locale(mod, locale, files)
+        temp = file + '.' + str(os.getpid())
+        with open(temp, 'wb') as f:
+            marshal.dump(values, f)
+        os.replace(temp, file)
+        return values
+
+    @staticmethod
+    def get_locale_files(mod, locale):
+        if not mod.exists('locale/'+locale+'/'):
+            return []
+        return [cfg for cfg in mod.listdir('locale/'+locale) if cfg.endswith('.cfg')]
+
+    @staticmethod
+    def parse_mod_locale(mod, locale, files=None):
         values = {}
-        for mod_name in self.mod_manager.mod_order:
-            mod = self.mod_manager.mods[mod_name]
-            if mod.exists('locale/'+locale+'/'):
-                for cfg in mod.listdir('locale/'+locale):
-                    if cfg.endswith('.cfg'):
-                        with mod.get_file(cfg) as f:
-                            env = ''
-                            for line in f:
-                                line = line.strip()
-                                if line.startswith('['):
-                                    assert line.endswith(']')
-                                    env = line[1:-1]+'.'
-                                elif '=' in line:
-                                    key = line.split('=')[0]
-                                    key = env + key
-                                    value = '='.join(line.split('=')[1:])
-                                    value = value.replace('\\n', '\n')
-                                    if key not in values:
-                                        values[key] = value
+        if files is None:
+            files = LocaleProvider.get_locale_files(mod, locale)
+        for cfg in files:
+            with mod.get_file(cfg) as f:
+                env = ''
+                for line in f:
+                    line = line.strip()
+                    if line.startswith('['):
+                        assert line.endswith(']')
+                        env = line[1:-1]+'.'
+                    elif '=' in line:
+                        key = line.split('=')[0]
+                        key = env + key
+                        value = '='.join(line.split('=')[1:])
+                        value = value.replace('\\n', '\n')
+                        if key not in values:
+                            values[key] = value
         return values
 
     def localise_string(self, t):
-        if type(t) == dict or lupa.lua_type(t) == 'table':
+        if type(t) == dict or lua_type(t) == 'table':
             key = t[1]
             params = [self.localise_string(t[i+2]) for i in range(len(t)-1)]
             if key == '':
@@ -457,6 +1146,3 @@ class LocaleProvider:
             return template
         else:
             return str(t)
-
-
-
@@ -1,8 +1,10 @@
+import hashlib
 import math
+import os
 import re
 import struct
 import collections
-import lupa
+from load import lua_type
 from PIL import Image, ImageChops, PngImagePlugin, ImageFile
 
 
@@ -32,19 +34,18 @@ PngImagePlugin.ChunkStream.crc = crc
 
 
 class IconLoader:
-    def __init__(self, mod_manager):
+    def __init__(self, mod_manager, cache_dir=None, cache=None):
         self.mod_manager = mod_manager
+        self.cache = {} if cache is None else cache
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
 
-    def get_raw_icon(self, prototype, expected_size):
+    @staticmethod
+    def get_layer(prototype, expected_size):
         file = prototype.icon
         assert file is not None
-        mod = file.split('/')[0]
-        assert mod.startswith('__') and mod.endswith('__')
-        mod = mod[2:-2]
-        file = '/'.join(file.split('/')[1:])
-        with self.mod_manager.mods[mod].get_binary(file) as f:
-            with PngImagePlugin.Image.open(f, 'r') as im_file:
-                im = im_file.convert('RGBA')
+        tint = None
         if prototype.tint is not None:
             red = prototype.tint.r or prototype.tint[1] or 0
             green = prototype.tint.g or prototype.tint[2] or 0
@@ -56,21 +57,32 @@ class IconLoader:
                 alpha = 1
             if red <= 1 and green <= 1 and blue <= 1 and alpha <= 1:
                 red, green, blue, alpha = red*255, green*255, blue*255, alpha*255
-            red, green, blue, alpha = int(red), int(green), int(blue), int(alpha)
+            tint = int(red), int(green), int(blue), int(alpha)
+        shift = None
+        if prototype.shift is not None:
+            shift = (prototype.shift[1], prototype.shift[2])
+        return file, tint, prototype.scale, shift, expected_size
+
+    def get_raw_icon(self, layer):
+        file, tint, scale, shift, expected_size = layer
+        mod = file.split('/')[0]
+        assert mod.startswith('__') and mod.endswith('__')
+        mod = mod[2:-2]
+        file = '/'.join(file.split('/')[1:])
+        with self.mod_manager.mods[mod].get_binary(file) as f:
+            with PngImagePlugin.Image.open(f, 'r') as im_file:
+                im = im_file.convert('RGBA')
+        if tint is not None:
+            red, green, blue, alpha = tint
             multiplier = Image.new('RGBA', im.size, (red, green, blue))
             multiplier.putalpha(alpha)
             im = ImageChops.multiply(im, multiplier)
-        if prototype.scale is not None:
-            scale = prototype.scale
+        if scale is not None:
             im = im.resize((int(im.width*scale), int(im.height*scale)), resample=Image.LANCZOS)
         else:
             im = im.resize((expected_size, expected_size), resample=Image.LANCZOS)
-        if prototype.shift is not None:
-            shift = (prototype.shift[1], prototype.shift[2])
-        elif prototype.scale is not None:
+        if shift is None and scale is not None:
             shift = (0, 0)
-        else:
-            shift = None
         if shift is not None:
             shift = (int(shift[0]+(expected_size-im.width)/2), int(shift[1]+(expected_size-im.height)/2))
             empty = Image.new('RGBA', (expected_size, expected_size), (255, 255, 255))
@@ -79,39 +91,126 @@ class IconLoader:
             im = empty
         return im
 
-    def get_icon(self, prototype, expected_size):
+    def get_icon_key(self, prototype, expected_size):
         if prototype.icon is not None:
-            return self.get_raw_icon(prototype, expected_size)
+            return expected_size, False, (self.get_layer(prototype, expected_size),)
+        layers = [self.get_layer(prototype.icons[p+1], expected_size) for p in range(len(prototype.icons))]
+        return expected_size, True, tuple(layers)
+
+    def render_icon(self, key):
+        expected_size, composite, layers = key
+        if not composite:
+            return self.get_raw_icon(layers[0])
         im = Image.new('RGBA', (expected_size, expected_size), (255, 255, 255))
         im.putalpha(0)
-        for p in range(len(prototype.icons)):
-            im = Image.alpha_composite(im, self.get_raw_icon(prototype.icons[p+1], expected_size))
+        for layer in layers:
+            im = Image.alpha_composite(im, self.get_raw_icon(layer))
+        return im
+
+    def get_versioned_key(self, key):
+        versions = []
+        for layer in key[2]:
+            mod = layer[0].split('/')[0][2:-2]
+            versions.append((mod, self.mod_manager.mods[mod].info['version']))
+        return key, tuple(versions)
+
+    def get_icon(self, prototype, expected_size):
+        # icons are only rendered when an atlas asks for them
+        return self.get_versioned_key(self.get_icon_key(prototype, expected_size))
+
+    def render(self, key):
+        if key in self.cache:
+            return self.cache[key]
+        if self.cache_dir is None:
+            im = self.render_icon(key[0])
+        else:
+            digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+            file = os.path.join(self.cache_dir, digest + '.png')
+            if os.path.exists(file):
+                with Image.open(file) as im_file:
+                    im = im_file.convert('RGBA')
+            else:
+                im = self.render_icon(key[0])
+                temp = file + '.' + str(os.getpid())
+                im.save(temp, 'PNG')
+                os.replace(temp, file)
+        self.cache[key] = im
         return im
 
+    def render_sheet(self, keys, icon_size, mapping=None):
+        if mapping is None:
+            mapping = IconLoader.get_atlas_mapping(keys)
+        return IconLoader.paste_atlas({name: self.render(keys[name]) for name in mapping}, icon_size, mapping)
+
     @staticmethod
-    def get_atlas(icons, icon_size):
-        width = math.ceil(math.sqrt(len(icons)))
-        height = math.ceil(len(icons) / width)
+    def get_atlas_mapping(names):
+        width = max(math.ceil(math.sqrt(len(names))), 1)
+        return {name: (i % width, i // width) for i, name in enumerate(names)}
+
+    @staticmethod
+    def get_atlas_layout(names, max_cells=None, groups=None):
+        # splits an atlas into tiles of at most max_cells x max_cells icons, starting a new tile for every group
+        runs = [list(names)]
+        if groups is not None:
+            runs = {}
+            for name in names:
+                group = groups.get(name, '')
+                if group not in runs:
+                    runs[group] = []
+                runs[group].append(name)
+            runs = list(runs.values())
+        tiles = []
+        for run in runs:
+            if max_cells is None:
+                tiles.append(run)
+            else:
+                capacity = max_cells * max_cells
+                tiles.extend(run[i:i+capacity] for i in range(0, len(run), capacity))
+        return [IconLoader.get_atlas_mapping(tile) for tile in tiles]
+
+    @staticmethod
+    def paste_atlas(icons, icon_size, mapping):
+        width = max((x+1 for x, y in mapping.values()), default=0)
+        height = max((y+1 for x, y in mapping.values()), default=0)
         atlas = Image.new('RGBA', (width*icon_size, height*icon_size), (255, 255, 255))
         atlas.putalpha(0)
-        mapping = {}
-        x = y = 0
-        for item in icons:
-            icon = icons[item]
-            atlas.paste(icon, (x*icon_size, y*icon_size))
-            mapping[item] = (x, y)
-            if x == width - 1:
-                x, y = 0, y+1
-            else:
-                x += 1
+        for item, (x, y) in mapping.items():
+            atlas.paste(icons[item], (x*icon_size, y*icon_size))
         background = Image.new('RGBA', (width * icon_size, height * icon_size), (127, 127, 127))
         background.putalpha(0)
-        atlas = Image.alpha_composite(background, atlas)
-        return atlas, mapping
+        return Image.alpha_composite(background, atlas)
+
+    @staticmethod
+    def get_atlas(icons, icon_size):
+        mapping = IconLoader.get_atlas_mapping(icons)
+        return IconLoader.paste_atlas(icons, icon_size, mapping), mapping
+
+
+class IconRegistry:
+    # icon keys of one extraction, grouped by the name prefix they are dumped with
+    def __init__(self, icon_loader):
+        self.icon_loader = icon_loader
+        self.icons = {}
+
+    def add(self, icon_type, name, prototype, expected_size):
+        if icon_type not in self.icons:
+            self.icons[icon_type] = {}
+        self.icons[icon_type][name] = self.icon_loader.get_icon(prototype, expected_size)
+
+    def alias(self, icon_type, name, source_type, source_name):
+        if icon_type not in self.icons:
+            self.icons[icon_type] = {}
+        self.icons[icon_type][name] = self.icons[source_type][source_name]
+
+    def get_keys(self, icon_type):
+        return self.icons.get(icon_type, {})
+
+    def release(self):
+        self.icons = {}
 
 
 class Prototype:
-    icons = None
+    icon_type = None
     icon_size = 32
 
     def __init__(self, prototype):
@@ -168,18 +267,15 @@ class Prototype:
     def get_localised_name(self, locale_provider):
         return locale_provider.localise_string(self.localised_name)
 
-    @classmethod
-    def get_atlas(cls):
-        return IconLoader.get_atlas(cls.icons, cls.icon_size)
-
 
 class ItemGroup(Prototype):
-    icons = {}
+    icon_type = 'group'
     icon_size = 64
 
-    def __init__(self, prototype, icon_loader):
+    def __init__(self, prototype, icon_registry):
         super().__init__(prototype)
-        ItemGroup.icons[self.name] = icon_loader.get_icon(prototype, 64)
+        if icon_registry is not None:
+            icon_registry.add(self.icon_type, self.name, prototype, 64)
         if self.localised_name is None:
             self.localised_name = {1: 'item-group-name.' + self.name}
         self.order_in_recipe = self._get_str(prototype.order_in_recipe, self.order)
@@ -192,13 +288,14 @@ class ItemSubGroup(Prototype):
 
 
 class Item(Prototype):
-    icons = {}
+    icon_type = 'item'
     icon_size = 32
 
-    def __init__(self, prototype, icon_loader):
+    def __init__(self, prototype, icon_registry):
         super().__init__(prototype)
         self.subgroup = self._get_str(prototype.subgroup, 'other')
-        Item.icons[self.name] = icon_loader.get_icon(prototype, 32)
+        if icon_registry is not None:
+            icon_registry.add(self.icon_type, self.name, prototype, 32)
         if self.localised_name is None:
             if prototype.place_result is not None:
                 self.localised_name = {1: 'entity-name.'+prototype.place_result}
@@ -209,13 +306,14 @@ class Item(Prototype):
 
 
 class Fluid(Prototype):
-    icons = {}
+    icon_type = 'fluid'
     icon_size = 32
 
-    def __init__(self, prototype, icon_loader):
+    def __init__(self, prototype, icon_registry):
         super().__init__(prototype)
         self.subgroup = self._get_str(prototype.subgroup, 'fluid')
-        Fluid.icons[self.name] = icon_loader.get_icon(prototype, 32)
+        if icon_registry is not None:
+            icon_registry.add(self.icon_type, self.name, prototype, 32)
         self.default_temperature = prototype.default_temperature
         self.max_temperature = prototype.max_temperature
         if self.localised_name is None:
@@ -226,23 +324,25 @@ class Fluid(Prototype):
 
 
 class Entity(Prototype):
-    icons = {}
+    icon_type = 'entity'
     icon_size = 32
 
-    def __init__(self, prototype, icon_loader):
+    def __init__(self, prototype, icon_registry):
         super().__init__(prototype)
-        Entity.icons[self.name] = icon_loader.get_icon(prototype, 32)
+        if icon_registry is not None:
+            icon_registry.add(self.icon_type, self.name, prototype, 32)
         if self.localised_name is None:
             self.localised_name = {1: 'entity-name.' + self.name}
 
 
 class Technology(Prototype):
-    icons = {}
+    icon_type = 'technology'
     icon_size = 128
 
-    def __init__(self, prototype, icon_loader, difficulty):
+    def __init__(self, prototype, icon_registry, difficulty):
         super().__init__(prototype)
-        Technology.icons[self.name] = icon_loader.get_icon(prototype, 128)
+        if icon_registry is not None:
+            icon_registry.add(self.icon_type, self.name, prototype, 128)
         match = re.match("^(.*)-(\\d+)$", self.name)
         if match:
             self.raw_name = match.group(1)
@@ -317,10 +417,10 @@ class Ingredient:
 
 
 class Recipe(Prototype):
-    icons = {}
+    icon_type = 'recipe'
     icon_size = 32
 
-    def __init__(self, prototype, icon_loader, difficulty, items, fluids):
+    def __init__(self, prototype, icon_registry, difficulty, items, fluids):
         super().__init__(prototype)
         self.category = self._get_str(prototype.category, 'crafting')
         recipe_data, enabled = Prototype._get_difficulty(prototype, difficulty)
@@ -349,14 +449,12 @@ class Recipe(Prototype):
                 self.localised_name = {1: 'recipe-name.'+self.name}
         if self.main_product == '':
             self.main_product = None
-        if prototype.icon is not None or prototype.icons is not None:
-            Recipe.icons[self.name] = icon_loader.get_icon(prototype, 32)
-        else:
-            assert self.main_product is not None
-            if self.main_product_type == 'item':
-                Recipe.icons[self.name] = Item.icons[self.main_product]
+        if icon_registry is not None:
+            if prototype.icon is not None or prototype.icons is not None:
+                icon_registry.add(self.icon_type, self.name, prototype, 32)
             else:
-                Recipe.icons[self.name] = Fluid.icons[self.main_product]
+                assert self.main_product is not None
+                icon_registry.alias(self.icon_type, self.name, self.main_product_type, self.main_product)
         self.subgroup = prototype.subgroup
         if self.subgroup is None:
             assert self.main_product is not None
@@ -372,8 +470,10 @@ class Recipe(Prototype):
 
 
 class Resource(Entity):
-    def __init__(self, prototype, icon_loader, fluids):
-        super().__init__(prototype, icon_loader)
+    icon_type = 'resource'
+
+    def __init__(self, prototype, icon_registry, fluids):
+        super().__init__(prototype, icon_registry)
         self.infinite = self._get_bool(prototype.infinite, False)
         self.category = self._get_str(prototype.category, "basic-solid")
         self.mining_time = prototype.minable.mining_time
@@ -386,8 +486,8 @@ class Resource(Entity):
 
 
 class MiningDrill(Entity):
-    def __init__(self, prototype, icon_loader):
-        super().__init__(prototype, icon_loader)
+    def __init__(self, prototype, icon_registry):
+        super().__init__(prototype, icon_registry)
         self.speed = prototype.mining_speed
         self.categories = list(prototype.resource_categories.values())
         self.input_fluid_box = 0 if prototype.input_fluid_box is None else 1
@@ -404,8 +504,8 @@ class MiningDrill(Entity):
 
 
 class CraftingMachine(Entity):
-    def __init__(self, prototype, icon_loader):
-        super().__init__(prototype, icon_loader)
+    def __init__(self, prototype, icon_registry):
+        super().__init__(prototype, icon_registry)
         self.speed = prototype.crafting_speed
         self.categories = list(prototype.crafting_categories.values())
         if prototype.allowed_effects is not None:
@@ -420,7 +520,7 @@ class CraftingMachine(Entity):
         self.output_fluid_box = 0
         if prototype.fluid_boxes is not None:
             for box in prototype.fluid_boxes.values():
-                if lupa.lua_type(box) == 'table':
+                if lua_type(box) == 'table':
                     if 'input' == box.production_type:
                         self.input_fluid_box += 1
                     elif 'output' == box.production_type:
@@ -431,15 +531,15 @@ class CraftingMachine(Entity):
 
 
 class OffshorePump(Entity):
-    def __init__(self, prototype, icon_loader):
-        super().__init__(prototype, icon_loader)
+    def __init__(self, prototype, icon_registry):
+        super().__init__(prototype, icon_registry)
         self.fluid = prototype.fluid
         self.pumping_speed = prototype.pumping_speed
 
 
 class Module(Item):
-    def __init__(self, prototype, icon_loader):
-        super().__init__(prototype, icon_loader)
+    def __init__(self, prototype, icon_registry):
+        super().__init__(prototype, icon_registry)
         self.category = prototype.category
         self.tier = prototype.tier
         self.effects = collections.defaultdict(float)
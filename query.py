@@ -0,0 +1,145 @@
+class DataQuery:
+    def __init__(self, data_extractor):
+        self.data_extractor = data_extractor
+        self.cache = {}
+        self.recipe_attrs = {}
+
+    def _memo(self, name, function):
+        if name not in self.cache:
+            self.cache[name] = function()
+        return self.cache[name]
+
+    def get_section(self, name):
+        return self.data_extractor.get_stage(name)
+
+    def get_icons(self):
+        return self.data_extractor.get_stage('icons')
+
+    def get_recipe(self, name):
+        if 'recipe_attr' in self.data_extractor.stage_results:
+            return self.data_extractor.stage_results['recipe_attr'].get(name)
+        if name not in self.recipe_attrs:
+            extractor = self.data_extractor
+            temperature_attr = self.get_section('temperature_attr')
+            type_, raw_name = name.split('/', 1)
+            if type_ == 'recipe':
+                attribute = extractor.get_single_recipe_attr(extractor.recipes[raw_name], temperature_attr)
+            else:
+                assert type_ == 'resource', name
+                attribute = extractor.get_single_resource_attr(extractor.resources[raw_name], temperature_attr)
+            self.recipe_attrs[name] = attribute
+        return self.recipe_attrs[name]
+
+    def get_localised_name(self, name):
+        extractor = self.data_extractor
+        type_, raw_name = name.split('/', 1)
+        if type_ == 'item':
+            prototype = extractor.items[raw_name]
+        elif type_ == 'fluid':
+            prototype = extractor.fluids[raw_name]
+        elif type_ == 'recipe':
+            prototype = extractor.recipes[raw_name]
+        elif type_ == 'resource':
+            prototype = extractor.resources[raw_name]
+        elif type_ == 'technology':
+            prototype = extractor.techs[raw_name]
+        elif type_ == 'group':
+            prototype = extractor.item_groups[raw_name]
+        else:
+            assert type_ == 'entity', name
+            prototype = extractor.crafting_machines.get(raw_name) or extractor.mining_drills.get(raw_name) or \
+                extractor.offshore_pumps[raw_name]
+        return prototype.get_localised_name(extractor.locale_provider)
+
+    @staticmethod
+    def _add(index, key, value):
+        # values arrive grouped, so a repeated value can only be the last one
+        if key not in index:
+            index[key] = []
+        if not index[key] or index[key][-1] != value:
+            index[key].append(value)
+
+    def _build_product_index(self):
+        index = {}
+        for recipe in self.data_extractor.recipes.values():
+            for product in recipe.results:
+                DataQuery._add(index, product.type+'/'+product.name, 'recipe/'+recipe.name)
+        for resource in self.data_extractor.resources.values():
+            for product in resource.results:
+                DataQuery._add(index, product.type+'/'+product.name, 'resource/'+resource.name)
+        return index
+
+    def _build_ingredient_index(self):
+        index = {}
+        for recipe in self.data_extractor.recipes.values():
+            for ingredient in recipe.ingredients:
+                DataQuery._add(index, ingredient.type+'/'+ingredient.name, 'recipe/'+recipe.name)
+        for resource in self.data_extractor.resources.values():
+            if resource.fluid_amount > 0:
+                DataQuery._add(index, 'fluid/'+resource.required_fluid, 'resource/'+resource.name)
+        return index
+
+    def _build_category_index(self):
+        index = {}
+        for recipe in self.data_extractor.recipes.values():
+            DataQuery._add(index, 'crafting/'+recipe.category, 'recipe/'+recipe.name)
+        for resource in self.data_extractor.resources.values():
+            DataQuery._add(index, 'mining/'+resource.category, 'resource/'+resource.name)
+        return index
+
+    def _build_technology_index(self):
+        index = {}
+        for tech in self.data_extractor.techs.values():
+            for recipe in tech.unlocks:
+                DataQuery._add(index, 'recipe/'+recipe, 'technology/'+tech.name)
+        return index
+
+    def get_index(self, name):
+        functions = {
+            'product': self._build_product_index,
+            'ingredient': self._build_ingredient_index,
+            'category': self._build_category_index,
+            'technology': self._build_technology_index,
+        }
+        return self._memo('index/'+name, functions[name])
+
+    def recipes_producing(self, material):
+        return self.get_index('product').get(material.split('@')[0], [])
+
+    def recipes_consuming(self, material):
+        return self.get_index('ingredient').get(material.split('@')[0], [])
+
+    def recipes_in_category(self, category):
+        return self.get_index('category').get(category, [])
+
+    def technologies_unlocking(self, recipe):
+        return self.get_index('technology').get(recipe, [])
+
+    def recipes_unlocked_by(self, technology):
+        return ['recipe/'+r for r in self.data_extractor.techs[technology.split('/', 1)[1]].unlocks]
+
+    def technologies_required_for(self, technology):
+        closure = self.get_section('tech_closure')
+        technologies = closure['technologies']
+        mask = int(closure['prerequisites'][technologies.index(technology)], 16)
+        return [t for i, t in enumerate(technologies) if mask >> i & 1]
+
+    def machines_for_category(self, category):
+        return self.data_extractor.get_stage('machine_list').get(category, [])
+
+    def machines_for_recipe(self, recipe):
+        extractor = self.data_extractor
+        type_, raw_name = recipe.split('/', 1)
+        if type_ == 'recipe':
+            category = 'crafting/'+extractor.recipes[raw_name].category
+        else:
+            category = 'mining/'+extractor.resources[raw_name].category
+        return self.machines_for_category(category)
+
+    def modules_for_recipe(self, recipe):
+        result = []
+        type_, raw_name = recipe.split('/', 1)
+        for module in sorted(self.data_extractor.modules.values()):
+            if not module.limitation or type_ == 'resource' or raw_name in module.limitation:
+                result.append('item/'+module.name)
+        return result
@@ -0,0 +1,191 @@
+import json
+import os
+import socketserver
+import sys
+import time
+import traceback
+from generate import DataExtractor
+from load import Mod, ModManager, PropertyTree, LocaleProvider
+from prototype import IconLoader
+from store import ContentStore
+
+
+class DumpServer:
+    def __init__(self, current_locale='zh-CN', default_locale='en'):
+        self.current_locale = current_locale
+        self.default_locale = default_locale
+        self.mod_cache = {}
+        self.chunk_cache = {}
+        self.locale_cache = {}
+        self.icon_cache = {}
+        self.stores = {}
+
+    @staticmethod
+    def get_stamp(path):
+        if os.path.isdir(path):
+            # a directory mod can be edited in place, so every file it contains is watched
+            count = size = mtime = 0
+            for root, dirs, files in os.walk(path):
+                for file in files:
+                    stat = os.stat(os.path.join(root, file))
+                    count += 1
+                    size += stat.st_size
+                    mtime = max(mtime, stat.st_mtime_ns)
+            return count, size, mtime
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def get_mod(self, path):
+        stamp = DumpServer.get_stamp(path)
+        cached = self.mod_cache.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        if cached is not None and cached[1] is not None:
+            self.invalidate(cached[1].info['name'])
+        mod = Mod.get_mod(path)
+        self.mod_cache[path] = stamp, mod
+        return mod
+
+    def scan_mods(self, game_dir, mods_dir):
+        inventory = ModManager.scan_mods(game_dir, mods_dir, self.get_mod)
+        present = set(os.path.join(game_dir, 'data', f) for f in os.listdir(os.path.join(game_dir, 'data')))
+        present.update(os.path.join(mods_dir, f) for f in os.listdir(mods_dir))
+        watched = os.path.normpath(os.path.join(game_dir, 'data')), os.path.normpath(mods_dir)
+        for path in list(self.mod_cache):
+            if os.path.normpath(os.path.dirname(path)) in watched and path not in present:
+                mod = self.mod_cache.pop(path)[1]
+                if mod is not None:
+                    self.invalidate(mod.info['name'])
+        return inventory
+
+    def invalidate(self, mod_name):
+        for key in list(self.chunk_cache):
+            if key[0] == mod_name:
+                del self.chunk_cache[key]
+        for key in list(self.locale_cache):
+            if key[0] == mod_name:
+                del self.locale_cache[key]
+        for cache in [self.icon_cache] + [store.icon_objects for store in self.stores.values()]:
+            for key in list(cache):
+                if any(mod == mod_name for mod, version in key[1]):
+                    del cache[key]
+
+    def dump(self, request):
+        game_dir = request['game_dir']
+        mods_dir = request['mods_dir']
+        timings = {}
+        start = time.perf_counter()
+        mod_list = request.get('mod_list')
+        if isinstance(mod_list, str):
+            with open(mod_list) as f:
+                mod_list = json.load(f)
+        mod_manager = ModManager(game_dir, mods_dir, mod_list=mod_list,
+                                 inventory=self.scan_mods(game_dir, mods_dir))
+        settings = request.get('settings') or os.path.join(mods_dir, 'mod-settings.dat')
+        mod_settings = PropertyTree.load_mod_settings(settings)
+        sections = request.get('sections')
+        locale_provider = None
+        if sections is None or 'localised_names' in sections:
+            locale_provider = LocaleProvider(self.current_locale, self.default_locale, mod_manager, self.locale_cache)
+        icon_loader = IconLoader(mod_manager, cache=self.icon_cache)
+        timings['mods'] = time.perf_counter() - start
+        data_extractor = DataExtractor(game_dir, mods_dir, request.get('difficulty', 'normal'),
+                                       mod_settings=mod_settings, mod_manager=mod_manager,
+                                       locale_provider=locale_provider, icon_loader=icon_loader,
+                                       chunk_cache=self.chunk_cache, sections=sections,
+                                       max_atlas_size=request.get('max_atlas_size'),
+                                       group_atlases=request.get('group_atlases', False),
+                                       compact_limitations=request.get('compact_limitations', False))
+        store = None
+        if request.get('store') is not None:
+            # stores are kept so that icons already in them are not encoded again
+            if request['store'] not in self.stores:
+                self.stores[request['store']] = ContentStore(request['store'])
+            store = self.stores[request['store']]
+        data_extractor.generate_and_dump(request['dir'], request.get('extras', ()), request.get('formats', ('json',)),
+                                         store)
+        for stage, seconds in data_extractor.timings.items():
+            if stage != 'mods':
+                timings[stage] = seconds
+        return {'dir': request['dir'], 'timings': timings}
+
+    def handle(self, request):
+        command = request.get('command', 'dump')
+        response = {'id': request.get('id'), 'status': 'ok'}
+        try:
+            if command == 'dump':
+                response.update(self.dump(request))
+            elif command == 'invalidate':
+                for mod_name in request.get('mods', []):
+                    self.invalidate(mod_name)
+            elif command == 'clear':
+                self.mod_cache.clear()
+                self.chunk_cache.clear()
+                self.locale_cache.clear()
+                self.icon_cache.clear()
+                self.stores.clear()
+            elif command not in ('ping', 'shutdown'):
+                raise ValueError('Unknown command ' + str(command))
+        except Exception:
+            response['status'] = 'error'
+            response['error'] = traceback.format_exc()
+        return response
+
+    def serve_stream(self, input, output):
+        for line in input:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = {'command': None}
+                response = {'id': None, 'status': 'error', 'error': 'Malformed request'}
+            else:
+                response = self.handle(request)
+            output.write(json.dumps(response) + '\n')
+            output.flush()
+            if request.get('command') == 'shutdown':
+                return True
+        return False
+
+    def serve_socket(self, path):
+        dump_server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                input = (line.decode('utf-8') for line in self.rfile)
+                output = _SocketWriter(self.wfile)
+                if dump_server.serve_stream(input, output):
+                    self.server.shutting_down = True
+
+        if os.path.exists(path):
+            os.remove(path)
+        with socketserver.UnixStreamServer(path, Handler) as server:
+            server.shutting_down = False
+            while not server.shutting_down:
+                server.handle_request()
+        os.remove(path)
+
+
+class _SocketWriter:
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, s):
+        self.wfile.write(s.encode('utf-8'))
+
+    def flush(self):
+        self.wfile.flush()
+
+
+if __name__ == '__main__':
+    dump_server = DumpServer()
+    if len(sys.argv) > 2 and sys.argv[1] == '--socket':
+        dump_server.serve_socket(sys.argv[2])
+    else:
+        # lua and python prints go to stderr, the protocol keeps the original stdout
+        output = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+        sys.stdout.flush()
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        dump_server.serve_stream(sys.stdin, output)
@@ -0,0 +1,70 @@
+import hashlib
+import io
+import json
+import os
+
+# Every object is named after the sha256 of its content and lives in objects/<first two digits>/<name>,
+# so dumps of different modpacks share identical sections, sheets and icons. A dump directory only
+# holds manifest.json, which maps section, sheet and icon names to object names.
+
+MANIFEST_VERSION = 1
+
+
+class ContentStore:
+    def __init__(self, root):
+        self.root = root
+        self.icon_objects = {}
+        self.written = 0
+        self.reused = 0
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+
+    def get_path(self, name):
+        return os.path.join(self.root, 'objects', name[:2], name)
+
+    def put(self, data, extension):
+        name = hashlib.sha256(data).hexdigest() + extension
+        path = self.get_path(name)
+        if os.path.exists(path):
+            self.reused += 1
+            return name
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = path + '.' + str(os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+        self.written += 1
+        return name
+
+    def put_json(self, value):
+        # keys are sorted so that the same content always has the same name
+        return self.put(json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8'), '.json')
+
+    def put_image(self, image):
+        f = io.BytesIO()
+        image.save(f, 'PNG')
+        return self.put(f.getvalue(), '.png')
+
+    def put_icon(self, icon_loader, key):
+        # icon keys carry the versions of the mods they come from, so they identify the rendered png
+        if key not in self.icon_objects:
+            self.icon_objects[key] = self.put_image(icon_loader.render(key))
+        return self.icon_objects[key]
+
+    def dump(self, dir, result, sheets, icons, icon_loader):
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'sections': {name: self.put_json(value) for name, value in result.items()},
+            'sheets': {name: self.put_image(image) for name, image in sheets.items()},
+            'icons': {name: self.put_icon(icon_loader, key) for name, key in icons.items()},
+        }
+        os.makedirs(dir, exist_ok=True)
+        with open(os.path.join(dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+
+def load_manifest(dir):
+    with open(os.path.join(dir, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    assert manifest['version'] == MANIFEST_VERSION, "Unsupported manifest version " + str(manifest['version'])
+    return manifest
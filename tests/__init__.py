@@ -0,0 +1,26 @@
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE = os.path.join(ROOT, 'tests', 'fixture')
+GAME_DIR = os.path.join(FIXTURE, 'game')
+MODS_DIR = os.path.join(FIXTURE, 'mods')
+MOD_SETTINGS = {'startup': {}, 'runtime-global': {}, 'runtime-per-user': {}}
+OPTIONAL_SECTIONS = ['material_index', 'recipe_matrix', 'tech_closure', 'machine_recipes']
+
+
+def use_root():
+    # serpent.lua and defines.lua are required relative to the working directory
+    os.chdir(ROOT)
+
+
+def create_extractor(**kwargs):
+    from generate import DataExtractor
+    use_root()
+    return DataExtractor(GAME_DIR, MODS_DIR, 'normal', mod_settings=MOD_SETTINGS, **kwargs)
+
+
+def generate(**kwargs):
+    from generate import DataExtractor
+    sections = list(DataExtractor.standard_sections) + OPTIONAL_SECTIONS
+    extractor = create_extractor(sections=sections, **kwargs)
+    return extractor, extractor.generate(render=False)[3]
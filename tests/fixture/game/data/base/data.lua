@@ -0,0 +1,56 @@
+data:extend{
+  {type="item-group", name="production", order="a", icon="__base__/graphics/group.png", icon_size=64},
+  {type="item-subgroup", name="raw", group="production", order="a"},
+  {type="item-subgroup", name="intermediate", group="production", order="b"},
+  {type="item-subgroup", name="fluid", group="production", order="c"},
+  {type="item-subgroup", name="other", group="production", order="z"},
+  {type="fluid", name="water", default_temperature=15, max_temperature=100, icon="__base__/graphics/water.png"},
+  {type="fluid", name="steam", default_temperature=15, max_temperature=1000, icon="__base__/graphics/steam.png"},
+  {type="item", name="iron-ore", subgroup="raw", order="a", icon="__base__/graphics/iron-ore.png"},
+  {type="item", name="coal", subgroup="raw", order="c", icon="__base__/graphics/coal.png"},
+  {type="item", name="iron-plate", subgroup="raw", order="b", icon="__base__/graphics/iron-plate.png"},
+  {type="item", name="iron-gear-wheel", subgroup="intermediate", order="a", icon="__base__/graphics/gear.png"},
+  {type="item", name="engine", subgroup="intermediate", order="b", icon="__base__/graphics/engine.png"},
+  {type="module", name="productivity-module", subgroup="intermediate", order="c", icon="__base__/graphics/prod.png",
+   category="productivity", tier=1, effect={productivity={bonus=0.04}, speed={bonus=-0.05}},
+   limitation={"iron-plate", "iron-gear-wheel", "no-such-recipe"}},
+  {type="module", name="productivity-module-2", subgroup="intermediate", order="d", icon="__base__/graphics/prod.png",
+   category="productivity", tier=2, effect={productivity={bonus=0.06}}, limitation={"iron-gear-wheel", "iron-plate"}},
+  {type="module", name="speed-module", subgroup="intermediate", order="e", icon="__base__/graphics/speed.png",
+   category="speed", tier=1, effect={speed={bonus=0.2}}},
+  {type="recipe", name="iron-plate", category="smelting", ingredients={{"iron-ore", 1}}, result="iron-plate",
+   energy_required=3.2},
+  {type="recipe", name="iron-gear-wheel", ingredients={{"iron-plate", 2}}, result="iron-gear-wheel", enabled=false},
+  {type="recipe", name="engine", ingredients={{"iron-gear-wheel", 1}, {"iron-plate", 1},
+   {type="fluid", name="steam", amount=10}}, result="engine", category="crafting-with-fluid", enabled=false,
+   energy_required=10},
+  {type="recipe", name="forging", category="crafting-with-fluid", ingredients={{"iron-plate", 1},
+   {type="fluid", name="steam", amount=5, minimum_temperature=400}}, result="iron-gear-wheel", enabled=false},
+  {type="recipe", name="steam", category="boiling", ingredients={{"coal", 1}},
+   results={{type="fluid", name="steam", amount=10, temperature=165}}, icon="__base__/graphics/steam.png",
+   subgroup="fluid"},
+  {type="recipe", name="hot-steam", category="boiling", ingredients={{"coal", 1}},
+   results={{type="fluid", name="steam", amount=10, temperature=500}}, icon="__base__/graphics/steam.png",
+   subgroup="fluid"},
+  {type="resource", name="iron-ore", order="a", icon="__base__/graphics/iron-ore.png",
+   minable={mining_time=1, result="iron-ore"}},
+  {type="mining-drill", name="mining-drill", icon="__base__/graphics/drill.png", mining_speed=0.5,
+   resource_categories={"basic-solid"}, module_specification={module_slots=3}},
+  {type="assembling-machine", name="assembler", icon="__base__/graphics/assembler.png", crafting_speed=0.75,
+   crafting_categories={"crafting", "crafting-with-fluid"}, ingredient_count=4,
+   fluid_boxes={{production_type="input"}}, allowed_effects={"speed", "productivity"},
+   module_specification={module_slots=2}},
+  {type="furnace", name="furnace", icon="__base__/graphics/furnace.png", crafting_speed=1,
+   crafting_categories={"smelting"}, source_inventory_size=1},
+  {type="assembling-machine", name="boiler", icon="__base__/graphics/boiler.png", crafting_speed=1,
+   crafting_categories={"boiling"}, ingredient_count=0,
+   fluid_boxes={{production_type="input"}, {production_type="output"}}},
+  {type="offshore-pump", name="offshore-pump", icon="__base__/graphics/pump.png", fluid="water", pumping_speed=20},
+  {type="technology", name="automation", icon="__base__/graphics/automation.png",
+   effects={{type="unlock-recipe", recipe="iron-gear-wheel"}}, unit={count=10}},
+  {type="technology", name="engine", icon="__base__/graphics/engine.png", prerequisites={"automation"},
+   effects={{type="unlock-recipe", recipe="engine"}}, unit={count=50}},
+  {type="technology", name="logistics", icon="__base__/graphics/logistics.png", unit={count=10}},
+  {type="technology", name="automobilism", icon="__base__/graphics/car.png", prerequisites={"engine", "logistics"},
+   unit={count=100}},
+}
@@ -0,0 +1,14 @@
+data = {raw = {}}
+for _, t in ipairs({"item", "ammo", "capsule", "gun", "module", "tool", "armor", "mining-tool", "repair-tool",
+                    "item-with-entity-data", "rail-planner", "item-with-label", "item-with-inventory",
+                    "item-with-tags", "deconstruction-item", "upgrade-item", "blueprint", "blueprint-book",
+                    "fluid", "technology", "item-group", "item-subgroup", "recipe", "resource", "mining-drill",
+                    "assembling-machine", "rocket-silo", "furnace", "offshore-pump"}) do
+  data.raw[t] = {}
+end
+
+function data:extend(prototypes)
+  for _, p in ipairs(prototypes) do
+    self.raw[p.type][p.name] = p
+  end
+end
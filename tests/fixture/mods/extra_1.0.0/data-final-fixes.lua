@@ -0,0 +1 @@
+data.raw.recipe["iron-gear-wheel"].energy_required = 0.5
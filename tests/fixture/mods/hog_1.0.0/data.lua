@@ -0,0 +1,4 @@
+local tables = {}
+for i = 1, 50000000 do
+  tables[i] = {i}
+end
@@ -0,0 +1,50 @@
+import io
+import json
+import unittest
+
+import columnar
+import tests
+
+
+class ColumnarTest(unittest.TestCase):
+    def round_trip(self, compact):
+        extractor, result = tests.generate(compact_limitations=compact)
+        fd = io.BytesIO()
+        columnar.dump(result, fd)
+        reader = columnar.ColumnarReader(fd.getvalue())
+        # json keeps 1 and 1.0 apart, so integers have to come back as integers
+        expected = json.dumps(result, sort_keys=True)
+        self.assertEqual(json.dumps(reader.to_dict(), sort_keys=True), expected)
+        return result, reader
+
+    def test_round_trip(self):
+        result, reader = self.round_trip(False)
+        self.assertNotIn('limitation_sets', reader.sections)
+
+    def test_round_trip_compact(self):
+        result, reader = self.round_trip(True)
+        self.assertIn('limitation_sets', reader.sections)
+
+    def test_module_allows(self):
+        result, reader = self.round_trip(True)
+        sets = result['limitation_sets']
+        for module, attribute in result['module_attr'].items():
+            for i, recipe in enumerate(sets['recipes']):
+                if attribute['limitation'] < 0:
+                    expected = True
+                else:
+                    expected = bool(int(sets['sets'][attribute['limitation']], 16) >> i & 1)
+                self.assertEqual(reader.module_allows(module, recipe), expected, (module, recipe))
+            self.assertEqual(reader.module_allows(module, 'recipe/no-such-recipe'), attribute['limitation'] < 0)
+
+    def test_version(self):
+        fd = io.BytesIO()
+        columnar.dump({'free_fluids': []}, fd)
+        data = bytearray(fd.getvalue())
+        data[4] = columnar.VERSION + 1
+        with self.assertRaises(AssertionError):
+            columnar.ColumnarReader(bytes(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
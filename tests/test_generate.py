@@ -0,0 +1,76 @@
+import unittest
+
+import tests
+
+
+class GenerateTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.extractor, cls.result = tests.generate()
+
+    def test_tech_closure(self):
+        closure = self.result['tech_closure']
+        technologies = closure['technologies']
+        self.assertEqual(technologies, ['technology/automation', 'technology/engine', 'technology/logistics',
+                                        'technology/automobilism'])
+        index = {name: i for i, name in enumerate(technologies)}
+        for i, name in enumerate(technologies):
+            expected = set()
+            pending = list(self.extractor.techs[name[len('technology/'):]].prerequisites)
+            while pending:
+                prerequisite = pending.pop()
+                expected.add(index['technology/'+prerequisite])
+                pending += self.extractor.techs[prerequisite].prerequisites
+            self.assertTrue(all(j < i for j in expected), name)
+            mask = int(closure['prerequisites'][i], 16)
+            self.assertEqual({j for j in range(len(technologies)) if mask >> j & 1}, expected, name)
+        self.assertEqual(closure['unlocks'], [['recipe/iron-gear-wheel'], ['recipe/engine'], [], []])
+
+    def test_recipe_matrix(self):
+        matrix = self.result['recipe_matrix']
+        recipe_attr = self.result['recipe_attr']
+        self.assertEqual(matrix['recipes'], [name for name in sorted(recipe_attr)
+                                             for ingredients in recipe_attr[name]['ingredients']])
+        self.assertEqual(matrix['recipes'].count('recipe/engine'), 2)
+        rows = iter(range(len(matrix['recipes'])))
+        for name in sorted(recipe_attr):
+            for ingredients in recipe_attr[name]['ingredients']:
+                expected = {}
+                for product, amount in recipe_attr[name]['products']:
+                    expected[product] = expected.get(product, 0) + amount
+                for ingredient, amount in ingredients:
+                    expected[ingredient] = expected.get(ingredient, 0) - amount
+                row = next(rows)
+                start, end = matrix['indptr'][row], matrix['indptr'][row+1]
+                indices = matrix['indices'][start:end]
+                self.assertEqual(indices, sorted(indices))
+                actual = {matrix['materials'][j]: v for j, v in zip(indices, matrix['values'][start:end])}
+                self.assertEqual(actual, {m: v for m, v in expected.items() if v != 0}, name)
+
+    def test_limitations(self):
+        module_attr = self.result['module_attr']
+        self.assertEqual(module_attr['item/speed-module']['limitation'], [])
+        expected = ['recipe/iron-gear-wheel', 'recipe/iron-plate', 'resource/iron-ore']
+        self.assertEqual(sorted(module_attr['item/productivity-module-2']['limitation']), expected)
+        self.assertEqual(sorted(module_attr['item/productivity-module']['limitation']),
+                         sorted(expected + ['recipe/no-such-recipe']))
+
+    def test_limitation_bitmasks(self):
+        extractor, result = tests.generate(compact_limitations=True)
+        sets = result['limitation_sets']
+        self.assertEqual(len(sets['sets']), 1)
+        recipes = sets['recipes']
+        self.assertEqual(recipes, ['recipe/'+name for name in sorted(extractor.recipes)] + ['resource/iron-ore'])
+        for module, attribute in result['module_attr'].items():
+            limitation = self.result['module_attr'][module]['limitation']
+            if not limitation:
+                self.assertEqual(attribute['limitation'], -1)
+                continue
+            mask = int(sets['sets'][attribute['limitation']], 16)
+            # recipes that do not exist are left out of the sets
+            self.assertEqual(sorted(r for i, r in enumerate(recipes) if mask >> i & 1),
+                             sorted(r for r in limitation if r in recipes))
+
+
+if __name__ == '__main__':
+    unittest.main()
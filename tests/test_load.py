@@ -0,0 +1,98 @@
+import unittest
+
+import tests
+from load import DirMod, Dependency, LuaLoader, ModManager
+
+
+def mod(name, version, dependencies=()):
+    return DirMod(name, {'name': name, 'version': version, 'dependencies': list(dependencies)})
+
+
+class DependencyTest(unittest.TestCase):
+    def test_parse(self):
+        dep = Dependency.parse('base >= 0.17')
+        self.assertEqual((dep.name, dep.bound, dep.optional, dep.incompatible), ('base', (0, 17, 0), False, False))
+        dep = Dependency.parse('? some mod')
+        self.assertEqual((dep.name, dep.compare, dep.optional), ('some mod', None, True))
+        self.assertTrue(Dependency.parse('(?) hidden').optional)
+        dep = Dependency.parse('! other = 1.2.3')
+        self.assertEqual((dep.name, dep.bound, dep.incompatible), ('other', (1, 2, 3), True))
+
+    def test_matches(self):
+        dep = Dependency.parse('base >= 0.17')
+        self.assertTrue(dep.matches(mod('base', '0.17.79')))
+        self.assertFalse(dep.matches(mod('base', '0.16.51')))
+        self.assertFalse(dep.matches(None))
+        self.assertTrue(Dependency.parse('base').matches(mod('base', '0.1.0')))
+
+    def test_check_dependency(self):
+        mods = {
+            'core': mod('core', '0.17.0'),
+            'base': mod('base', '0.17.79', ['core']),
+            'a': mod('a', '1.0.0', ['b', '? missing']),
+            'b': mod('b', '1.0.0', ['base >= 0.17']),
+        }
+        order, errors = ModManager.check_dependency(mods)
+        self.assertEqual(errors, [])
+        self.assertEqual(order, ['core', 'base', 'b', 'a'])
+
+    def test_check_dependency_errors(self):
+        mods = {
+            'core': mod('core', '0.17.0'),
+            'base': mod('base', '0.17.79', ['core']),
+            'a': mod('a', '1.0.0', ['! base', 'missing']),
+            'b': mod('b', '1.0.0', ['base >= 1.0']),
+            'c': mod('c', '1.0.0', ['d']),
+            'd': mod('d', '1.0.0', ['c']),
+        }
+        order, errors = ModManager.check_dependency(mods)
+        self.assertIn('a: incompatible mod is enabled: ! base', errors)
+        self.assertIn('a: dependency not satisfied: missing', errors)
+        self.assertIn('b: dependency not satisfied: base >= 1.0', errors)
+        self.assertTrue(any(e.startswith('Circular dependency: ') for e in errors), errors)
+        self.assertEqual(len(errors), 4)
+
+
+class ModManagerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.mod_manager = ModManager(tests.GAME_DIR, tests.MODS_DIR)
+
+    def test_mod_list(self):
+        self.assertEqual(self.mod_manager.mod_order, ['core', 'base', 'extra'])
+        self.assertEqual(self.mod_manager.mods['extra'].info['version'], '1.0.0')
+
+    def test_select_mods(self):
+        mods, errors = self.mod_manager.select_mods(['base', 'extra'], {'extra': '0.9.0'})
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(mods), ['base', 'core', 'extra'])
+        self.assertEqual(mods['extra'].version, (0, 9, 0))
+        mods, errors = self.mod_manager.select_mods(['base', 'extra', 'nope'], {'extra': '2.0.0'})
+        self.assertEqual(errors, ['Cannot locate mod extra with version 2.0.0', 'Cannot locate mod nope'])
+        self.assertEqual(sorted(mods), ['base', 'core'])
+
+    def test_evaluate(self):
+        self.assertEqual(self.mod_manager.evaluate(['base', 'extra', 'hog']), (['core', 'base', 'extra', 'hog'], []))
+        order, errors = self.mod_manager.evaluate(['extra', 'nope'])
+        self.assertIsNone(order)
+        self.assertEqual(errors, ['Cannot locate mod nope', 'extra: dependency not satisfied: base >= 0.17'])
+
+
+class BudgetTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        tests.use_root()
+        cls.mod_manager = ModManager(tests.GAME_DIR, tests.MODS_DIR).with_mods(['base', 'hog'])
+
+    def test_time_budget(self):
+        with self.assertRaisesRegex(AssertionError, r'^Mod hog 1\.0\.0 \(data\.lua\): time budget exceeded$'):
+            LuaLoader(self.mod_manager, tests.MOD_SETTINGS, time_budget={'data': 0.05})
+
+    def test_memory_budget(self):
+        message = r'^Mod hog 1\.0\.0 \(data\.lua\): (memory budget exceeded|not enough memory)$'
+        with self.assertRaisesRegex(AssertionError, message):
+            LuaLoader(self.mod_manager, tests.MOD_SETTINGS, memory_budget=16 * 2**20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import copy
+import json
+import unittest
+
+import jsonschema
+
+import tests
+import validate
+
+
+class ValidateTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # the dump is checked as it is written to info.json
+        cls.result = json.loads(json.dumps(tests.generate()[1]))
+        with open(validate.SCHEMA_PATH, encoding='utf-8') as f:
+            cls.schema = json.load(f)
+        cls.validator = staticmethod(validate.compile_schema(cls.schema))
+
+    def assertSameVerdict(self, instance):
+        expected = jsonschema.Draft7Validator(self.schema).is_valid(instance)
+        try:
+            self.validator(instance)
+            valid = True
+        except AssertionError:
+            valid = False
+        self.assertEqual(valid, expected)
+
+    def test_valid(self):
+        self.assertSameVerdict(self.result)
+        validate.validate_info(self.result)
+
+    def test_invalid(self):
+        mutations = [
+            lambda r: r.pop('recipe_attr'),
+            lambda r: r.update(unknown_section=1),
+            lambda r: r['recipe_attr']['recipe/engine'].update(time='fast'),
+            lambda r: r['recipe_attr']['recipe/engine']['products'].append(['item/engine']),
+            lambda r: r['machine_attr']['entity/assembler'].update(module=1.5),
+            lambda r: r['machine_attr']['entity/assembler'].update(speed=-1),
+            lambda r: r['module_attr']['item/speed-module'].update(limitation='recipe/engine'),
+            lambda r: r['localised_names'].update({'item/engine': 3}),
+            lambda r: r['icon_mapping']['small'].update({'item/engine': [0]}),
+            lambda r: r['temperature_attr'].update({'fluid/steam': [165]}),
+            lambda r: r['unlockable_recipes'].append(None),
+            lambda r: r['order_info'].pop('module'),
+        ]
+        for mutate in mutations:
+            instance = copy.deepcopy(self.result)
+            mutate(instance)
+            self.assertSameVerdict(instance)
+
+    def test_partial(self):
+        partial = {name: self.result[name] for name in ('recipe_attr', 'machine_attr')}
+        validate.validate_info(partial, partial=True)
+        with self.assertRaises(AssertionError):
+            validate.validate_info(partial)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+import json
+import os
+import re
+import sys
+import time
+
+# Compiles info_schema.json into plain python closures. Only the keywords used by the schema are
+# supported; each compiled check returns None when the value is valid, or (path, message) otherwise.
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'info_schema.json')
+IGNORED_KEYWORDS = {'$schema', '$version', 'definitions', 'title', 'description'}
+
+
+def _is_number(v):
+    return (type(v) is int or type(v) is float)
+
+
+def _is_integer(v):
+    return type(v) is int or (type(v) is float and v.is_integer())
+
+
+TYPE_CHECKS = {
+    'string': lambda v: type(v) is str,
+    'number': _is_number,
+    'integer': _is_integer,
+    'boolean': lambda v: type(v) is bool,
+    'null': lambda v: v is None,
+    'array': lambda v: type(v) is list or type(v) is tuple,
+    'object': lambda v: type(v) is dict,
+}
+
+
+class SchemaCompiler:
+    def __init__(self, schema):
+        self.schema = schema
+        self.refs = {}
+
+    def resolve(self, schema):
+        while '$ref' in schema:
+            ref = schema['$ref']
+            assert ref.startswith('#/'), "Unsupported reference " + ref
+            target = self.schema
+            for part in ref[2:].split('/'):
+                target = target[part]
+            schema = target
+        return schema
+
+    def compile_ref(self, ref):
+        if ref not in self.refs:
+            cell = []
+            self.refs[ref] = lambda v: cell[0](v)
+            schema = self.resolve({'$ref': ref})
+            cell.append(self.compile(schema))
+            self.refs[ref] = cell[0]
+        return self.refs[ref]
+
+    def compile_string_predicate(self, schema):
+        # a schema that only restricts strings becomes a predicate on str, so that
+        # oneOf over names needs no exception handling or nested error reporting
+        schema = self.resolve(schema)
+        if 'oneOf' in schema:
+            if set(schema) - IGNORED_KEYWORDS - {'oneOf', 'type'} or schema.get('type', 'string') != 'string':
+                return None
+            predicates = [self.compile_string_predicate(s) for s in schema['oneOf']]
+            if any(p is None for p in predicates):
+                return None
+            return lambda v: sum(1 for p in predicates if p(v)) == 1
+        if schema.get('type') != 'string' or set(schema) - IGNORED_KEYWORDS - {'type', 'pattern', 'const'}:
+            return None
+        checks = []
+        if 'pattern' in schema:
+            checks.append(re.compile(schema['pattern']).search)
+        if 'const' in schema:
+            const = schema['const']
+            checks.append(lambda v: v == const)
+        if not checks:
+            return lambda v: True
+        if len(checks) == 1:
+            return checks[0]
+        return lambda v: all(c(v) for c in checks)
+
+    def compile(self, schema):
+        if '$ref' in schema and len(schema) == 1:
+            return self.compile_ref(schema['$ref'])
+        schema = self.resolve(schema)
+        unknown = set(schema) - IGNORED_KEYWORDS - {
+            'type', 'pattern', 'const', 'oneOf', 'properties', 'additionalProperties', 'required',
+            'propertyNames', 'items', 'additionalItems', 'minItems', 'maxItems', 'minimum', 'exclusiveMinimum'}
+        assert not unknown, "Unsupported schema keywords " + str(unknown)
+
+        predicate = self.compile_string_predicate(schema)
+        if predicate is not None:
+            def check_string(v):
+                if type(v) is not str:
+                    return (), 'expected a string, got ' + repr(v)
+                if not predicate(v):
+                    return (), 'invalid name ' + repr(v)
+            return check_string
+
+        checks = []
+        if 'type' in schema:
+            type_name = schema['type']
+            type_check = TYPE_CHECKS[type_name]
+
+            def check_type(v):
+                if not type_check(v):
+                    return (), 'expected ' + type_name + ', got ' + repr(v)[:80]
+            checks.append(check_type)
+        if 'oneOf' in schema:
+            branches = [self.compile(s) for s in schema['oneOf']]
+
+            def check_one_of(v):
+                matched = sum(1 for b in branches if b(v) is None)
+                if matched != 1:
+                    return (), 'matched ' + str(matched) + ' schemas in oneOf for ' + repr(v)[:80]
+            checks.append(check_one_of)
+        if 'minimum' in schema or 'exclusiveMinimum' in schema:
+            minimum = schema.get('minimum')
+            exclusive_minimum = schema.get('exclusiveMinimum')
+
+            def check_minimum(v):
+                if not _is_number(v):
+                    return
+                if minimum is not None and v < minimum:
+                    return (), repr(v) + ' is less than ' + repr(minimum)
+                if exclusive_minimum is not None and v <= exclusive_minimum:
+                    return (), repr(v) + ' is not greater than ' + repr(exclusive_minimum)
+            checks.append(check_minimum)
+        if any(k in schema for k in ('properties', 'additionalProperties', 'required', 'propertyNames')):
+            checks.append(self.compile_object(schema))
+        if any(k in schema for k in ('items', 'additionalItems', 'minItems', 'maxItems')):
+            checks.append(self.compile_array(schema))
+
+        if len(checks) == 1:
+            return checks[0]
+
+        def check_all(v):
+            for check in checks:
+                error = check(v)
+                if error is not None:
+                    return error
+        return check_all
+
+    def compile_object(self, schema):
+        properties = {k: self.compile(s) for k, s in schema.get('properties', {}).items()}
+        required = schema.get('required', [])
+        additional = schema.get('additionalProperties', True)
+        if additional is True:
+            additional = None
+        elif additional is not False:
+            additional = self.compile(additional)
+        forbid_additional = schema.get('additionalProperties', True) is False
+        names = self.compile(schema['propertyNames']) if 'propertyNames' in schema else None
+
+        def check_object(v):
+            if type(v) is not dict:
+                return
+            for key in required:
+                if key not in v:
+                    return (), 'missing required property ' + repr(key)
+            for key, value in v.items():
+                if type(key) is not str:
+                    return (), 'property name is not a string: ' + repr(key)
+                if names is not None:
+                    error = names(key)
+                    if error is not None:
+                        return (key,), error[1]
+                check = properties.get(key)
+                if check is None:
+                    if forbid_additional:
+                        return (), 'additional property ' + repr(key)
+                    check = additional
+                if check is not None:
+                    error = check(value)
+                    if error is not None:
+                        return (key,) + error[0], error[1]
+        return check_object
+
+    def compile_array(self, schema):
+        items = schema.get('items')
+        tuple_items = None
+        each_item = None
+        if isinstance(items, list):
+            tuple_items = [self.compile(s) for s in items]
+        elif items is not None:
+            each_item = self.compile(items)
+        additional = schema.get('additionalItems', True)
+        min_items = schema.get('minItems')
+        max_items = schema.get('maxItems')
+
+        def check_array(v):
+            if type(v) is not list and type(v) is not tuple:
+                return
+            if min_items is not None and len(v) < min_items:
+                return (), 'expected at least ' + str(min_items) + ' items'
+            if max_items is not None and len(v) > max_items:
+                return (), 'expected at most ' + str(max_items) + ' items'
+            if each_item is not None:
+                for i, value in enumerate(v):
+                    error = each_item(value)
+                    if error is not None:
+                        return (i,) + error[0], error[1]
+            elif tuple_items is not None:
+                if additional is False and len(v) > len(tuple_items):
+                    return (), 'expected at most ' + str(len(tuple_items)) + ' items'
+                for i, (check, value) in enumerate(zip(tuple_items, v)):
+                    error = check(value)
+                    if error is not None:
+                        return (i,) + error[0], error[1]
+        return check_array
+
+
+def compile_schema(schema):
+    check = SchemaCompiler(schema).compile(schema)
+
+    def validate(instance):
+        error = check(instance)
+        if error is not None:
+            path = '/'.join(str(p) for p in error[0])
+            raise AssertionError('Invalid dump at /' + path + ': ' + error[1])
+    return validate
+
+
+_info_validators = {}
+
+
+def validate_info(result, partial=False):
+    # a partial dump only carries the sections that were selected for extraction
+    if partial not in _info_validators:
+        with open(SCHEMA_PATH, encoding='utf-8') as f:
+            schema = json.load(f)
+        if partial:
+            schema.pop('required', None)
+        _info_validators[partial] = compile_schema(schema)
+    _info_validators[partial](result)
+
+
+def benchmark(result, repeat=3):
+    import jsonschema
+    with open(SCHEMA_PATH, encoding='utf-8') as f:
+        schema = json.load(f)
+    timings = {}
+    start = time.perf_counter()
+    validator = compile_schema(schema)
+    timings['compile'] = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(repeat):
+        validator(result)
+    timings['compiled'] = (time.perf_counter() - start) / repeat
+    start = time.perf_counter()
+    for i in range(repeat):
+        jsonschema.validate(result, schema)
+    timings['jsonschema'] = (time.perf_counter() - start) / repeat
+    return timings
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], encoding='utf-8') as f:
+        info = json.load(f)
+    for name, seconds in benchmark(info).items():
+        print('%s: %.4fs' % (name, seconds))